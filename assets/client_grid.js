@@ -0,0 +1,209 @@
+/* Client-side filtering of the quantized grid served by grid_client.py. */
+(function () {
+    'use strict';
+
+    var MISSING = 65535;
+    var SYMBOLS = ['circle', 'diamond', 'square', 'x', 'cross'];
+    var state = {hash: null, grid: null};
+
+    function decode(buffer, manifest) {
+        var grid = {rows: manifest.rows, codes: {}, axes: {}, values: {}};
+        manifest.columns.forEach(function (column) {
+            var Type = column.dtype === 'uint8' ? Uint8Array : Uint16Array;
+            var codes = new Type(buffer, column.offset, manifest.rows);
+            if (column.values) {
+                grid.codes[column.name] = codes;
+                grid.axes[column.name] = column.values;
+                return;
+            }
+            var values = new Float32Array(manifest.rows);
+            for (var i = 0; i < codes.length; i++) {
+                values[i] = codes[i] === MISSING
+                    ? NaN : column.zero + column.scale * codes[i];
+            }
+            grid.values[column.name] = values;
+        });
+        return grid;
+    }
+
+    function allowedCodes(axis, range) {
+        var low = Math.min(range[0], range[1]) - 1e-9;
+        var high = Math.max(range[0], range[1]) + 1e-9;
+        return axis.map(function (value) {
+            return value >= low && value <= high;
+        });
+    }
+
+    function select(grid, ranges) {
+        var names = Object.keys(ranges);
+        var allowed = names.map(function (name) {
+            return allowedCodes(grid.axes[name], ranges[name]);
+        });
+        var codes = names.map(function (name) {
+            return grid.codes[name];
+        });
+        var rows = new Int32Array(grid.rows);
+        var count = 0;
+        for (var row = 0; row < grid.rows; row++) {
+            var keep = true;
+            for (var j = 0; j < names.length && keep; j++) {
+                keep = allowed[j][codes[j][row]];
+            }
+            if (keep) {
+                rows[count++] = row;
+            }
+        }
+        return rows.subarray(0, count);
+    }
+
+    function column(grid, name, rows) {
+        var out = new Float64Array(rows.length);
+        var i;
+        if (grid.codes[name]) {
+            var axis = grid.axes[name];
+            var codes = grid.codes[name];
+            for (i = 0; i < rows.length; i++) {
+                out[i] = axis[codes[rows[i]]];
+            }
+        } else {
+            var values = grid.values[name];
+            for (i = 0; i < rows.length; i++) {
+                out[i] = values[rows[i]];
+            }
+        }
+        return out;
+    }
+
+    function formatValues(values, limit) {
+        var labels = values.slice(0, limit).map(function (value) {
+            return String(parseFloat(value.toPrecision(6)));
+        });
+        if (values.length > limit) {
+            labels.push('... (' + values.length + ' values)');
+        }
+        return labels.join(', ');
+    }
+
+    function symbolTraces(grid, name, rows) {
+        var codes = grid.codes[name];
+        var axis = grid.axes[name];
+        var present = new Uint8Array(axis.length);
+        var i;
+        for (i = 0; i < rows.length; i++) {
+            present[codes[rows[i]]] = 1;
+        }
+        var rank = new Int32Array(axis.length);
+        var values = [];
+        for (i = 0; i < axis.length; i++) {
+            rank[i] = values.length;
+            if (present[i]) {
+                values.push(axis[i]);
+            }
+        }
+        var symbols = new Array(rows.length);
+        for (i = 0; i < rows.length; i++) {
+            symbols[i] = SYMBOLS[rank[codes[rows[i]]] % SYMBOLS.length];
+        }
+        var legend = SYMBOLS.slice(0, values.length).map(function (symbol, k) {
+            var shared = values.filter(function (_, index) {
+                return index % SYMBOLS.length === k;
+            });
+            return {
+                type: 'scattergl', x: [null], y: [null], mode: 'markers',
+                marker: {symbol: symbol, color: '#444'},
+                name: name + ' = ' + formatValues(shared, 4),
+                showlegend: true, hoverinfo: 'skip'
+            };
+        });
+        return {symbols: symbols, legend: legend};
+    }
+
+    function errorBoxes(target, x, y) {
+        if (!target || !target.columns[x] || !target.columns[y]) {
+            return [];
+        }
+        var shapes = [];
+        var tx = target.columns[x], ty = target.columns[y];
+        for (var sigma = 1; sigma <= target.sigma; sigma++) {
+            shapes.push({
+                type: 'rect',
+                x0: tx[0] - sigma * tx[1], x1: tx[0] + sigma * tx[1],
+                y0: ty[0] - sigma * ty[1], y1: ty[0] + sigma * ty[1],
+                line: {color: target.color, width: 2}
+            });
+        }
+        return shapes;
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        grid: {
+            load: function (nIntervals, manifest) {
+                if (!manifest) {
+                    return window.dash_clientside.no_update;
+                }
+                if (state.hash !== manifest.hash) {
+                    state.hash = manifest.hash;
+                    state.grid = null;
+                    // The URL holds the content hash, so the browser cache
+                    // keeps the grid until it changes.
+                    fetch(manifest.url).then(function (response) {
+                        return response.arrayBuffer();
+                    }).then(function (buffer) {
+                        if (state.hash === manifest.hash) {
+                            state.grid = decode(buffer, manifest);
+                        }
+                    });
+                }
+                return state.grid
+                    ? manifest.hash : window.dash_clientside.no_update;
+            },
+
+            loaded: function (ready) {
+                return Boolean(ready);
+            },
+
+            figure: function (ready, zi, mi, menv, yc, color, symbol, target,
+                              view) {
+                if (!ready || !state.grid) {
+                    return window.dash_clientside.no_update;
+                }
+                var grid = state.grid;
+                var rows = select(grid, {
+                    z_i: zi, m_i: mi, m_env: menv, y_c: yc
+                });
+                var symbols = symbolTraces(grid, symbol, rows);
+                var points = {
+                    type: 'scattergl',
+                    x: column(grid, view.x, rows),
+                    y: column(grid, view.y, rows),
+                    mode: 'markers',
+                    marker: {
+                        color: column(grid, color, rows),
+                        coloraxis: 'coloraxis',
+                        symbol: symbols.symbols
+                    },
+                    customdata: column(grid, symbol, rows),
+                    hovertemplate: view.x + '=%{x}<br>' + view.y + '=%{y}<br>'
+                        + color + '=%{marker.color}<br>'
+                        + symbol + '=%{customdata}<extra></extra>',
+                    showlegend: false
+                };
+                return {
+                    data: [points].concat(symbols.legend),
+                    layout: {
+                        height: 800,
+                        uirevision: view.graph,
+                        xaxis: {title: {text: view.x},
+                                autorange: view.x_reverse ? 'reversed' : true},
+                        yaxis: {title: {text: view.y},
+                                autorange: view.y_reverse ? 'reversed' : true},
+                        coloraxis: {colorbar: {title: {text: color}}},
+                        legend: {title: {text: symbol}, orientation: 'h',
+                                 itemclick: false, itemdoubleclick: false},
+                        shapes: errorBoxes(target, view.x, view.y)
+                    }
+                };
+            }
+        }
+    });
+}());
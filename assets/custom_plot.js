@@ -0,0 +1,78 @@
+/* Rendering of the custom plot from the updates sent by the server. */
+(function () {
+    'use strict';
+
+    function replaceAxis(trace, axis, update) {
+        var values = update.values[trace.meta];
+        if (values === undefined) {
+            return trace;
+        }
+        var replaced = Object.assign({}, trace);
+        replaced[axis] = values;
+        if (trace.hovertemplate) {
+            replaced.hovertemplate = trace.hovertemplate.split('<br>')
+                .map(function (line) {
+                    return line.indexOf('%{' + axis) >= 0
+                        ? update.label : line;
+                }).join('<br>');
+        }
+        return replaced;
+    }
+
+    function withAxes(figure, axes) {
+        var data = figure.data;
+        var layout = Object.assign({}, figure.layout,
+                                   {uirevision: axes.uirevision});
+        ['x', 'y'].forEach(function (axis) {
+            if (!axes[axis]) {
+                return;
+            }
+            data = data.map(function (trace) {
+                return replaceAxis(trace, axis, axes[axis]);
+            });
+            layout[axis + 'axis'] = Object.assign(
+                {}, layout[axis + 'axis'],
+                {title: {text: axes[axis].title}, autorange: true});
+            delete layout[axis + 'axis'].range;
+        });
+        return {data: data, layout: layout};
+    }
+
+    function orient(layout, name, reverse) {
+        var axis = Object.assign({}, layout[name]);
+        if (axis.range && axis.autorange === false) {
+            var range = axis.range.slice().sort(function (a, b) {
+                return a - b;
+            });
+            axis.range = reverse ? range.reverse() : range;
+        } else {
+            axis.autorange = reverse ? 'reversed' : true;
+        }
+        layout[name] = axis;
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        custom: {
+            render: function (update, xReverse, yReverse, figure) {
+                var triggered = window.dash_clientside.callback_context
+                    .triggered.map(function (trigger) {
+                        return trigger.prop_id;
+                    });
+                var base = figure;
+                if (update && triggered.indexOf(
+                        'custom_plot-figure.data') >= 0) {
+                    // Either a whole figure, or new values of the axes for
+                    // the traces of the figure already shown.
+                    base = update.figure || withAxes(figure, update.axes);
+                }
+                if (!base || !base.layout) {
+                    return window.dash_clientside.no_update;
+                }
+                var layout = Object.assign({}, base.layout);
+                orient(layout, 'xaxis', xReverse);
+                orient(layout, 'yaxis', yReverse);
+                return Object.assign({}, base, {layout: layout});
+            }
+        }
+    });
+}());
@@ -0,0 +1,65 @@
+/* Decoding of the base64 typed arrays in the callback responses. */
+(function () {
+    'use strict';
+
+    var arrayTypes = {
+        i1: Int8Array,
+        u1: Uint8Array,
+        u1c: Uint8ClampedArray,
+        i2: Int16Array,
+        u2: Uint16Array,
+        i4: Int32Array,
+        u4: Uint32Array,
+        f4: Float32Array,
+        f8: Float64Array
+    };
+
+    function isTypedArraySpec(value) {
+        return typeof value.bdata === 'string'
+            && arrayTypes.hasOwnProperty(value.dtype);
+    }
+
+    // The typed array is a view of the decoded bytes, and the rows of a
+    // 2D array are views of the typed array, so nothing is copied.
+    function typedArray(spec) {
+        var binary = window.atob(spec.bdata);
+        var bytes = new Uint8Array(binary.length);
+        for (var i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+        var values = new arrayTypes[spec.dtype](bytes.buffer);
+        if (!spec.shape) {
+            return values;
+        }
+        var shape = String(spec.shape).split(',').map(Number);
+        if (shape.length < 2) {
+            return values;
+        }
+        var rows = [];
+        for (var row = 0; row < shape[0]; row++) {
+            rows.push(values.subarray(row * shape[1], (row + 1) * shape[1]));
+        }
+        return rows;
+    }
+
+    function decode(value) {
+        if (value === null || typeof value !== 'object'
+                || ArrayBuffer.isView(value)) {
+            return value;
+        }
+        if (isTypedArraySpec(value)) {
+            return typedArray(value);
+        }
+        // In place, so the decoded response is the one Dash applies.
+        Object.keys(value).forEach(function (key) {
+            value[key] = decode(value[key]);
+        });
+        return value;
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        arrays: {
+            decode: decode
+        }
+    });
+}());
@@ -0,0 +1,166 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from grid_synthetic import synthetic_models, write_database
+
+logger = logging.getLogger(__name__)
+
+repo_dir = Path(__file__).resolve().parent
+
+# (graph, x, y, x function, y function), as drawn by the plot callbacks
+# with their default settings.
+views = [
+    ('logg-teff', 'Teff', 'log_g', 1, 1),
+    ('L-teff', 'Teff', 'L', 1, 1),
+    ('R-teff', 'Teff', 'radius', 1, 1),
+    ('custom_plot', 'Teff', 'log_g', 1, 1),
+]
+
+# Slider ranges of the default view and of the whole grid.
+selections = {
+    'default': ([0.005, 0.035], [1.0, 1.5], [0.0, 0.003], [0.1, 0.9]),
+    'full': ([0.005, 0.035], [1.0, 1.8], [0.0, 0.01], [0.1, 0.9]),
+}
+
+
+def best_time(function, repeats):
+    """Return the shortest of `repeats` timings of `function()` and its
+    last result."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def time_import(env):
+    """Time importing the app in a fresh interpreter."""
+    code = ('import time; start = time.perf_counter(); '
+            'import sdb_grid_viewer; print(time.perf_counter() - start)')
+    result = subprocess.run([sys.executable, '-c', code], cwd=repo_dir,
+                            env=env, check=True, capture_output=True,
+                            text=True)
+    return float(result.stdout.split()[-1])
+
+
+def measure(repeats):
+    """Time the stages of every view in the already configured app."""
+    import plotly.io as pio
+
+    import sdb_grid_viewer as viewer
+    from grid_figures import encoded_arrays
+
+    results = {'models': len(viewer.dataset), 'selections': {}}
+    for name, ranges in selections.items():
+        key = viewer.selection_key(*ranges)
+        filter_time, rows = best_time(
+            lambda: viewer._select_rows(viewer.dataset, key), repeats)
+        stages = {'rows': len(rows), 'filter_s': filter_time, 'views': {}}
+        for graph, x, y, x_function, y_function in views:
+            figure_time, fig = best_time(
+                lambda: viewer.plot_models(rows, x, y, 'z_i', 'm_i',
+                                           viewer.hover_data,
+                                           x_function=x_function,
+                                           y_function=y_function),
+                repeats)
+            json_time, payload = best_time(lambda: pio.to_json(fig),
+                                           repeats)
+            typed_time, typed_payload = best_time(
+                lambda: pio.to_json(encoded_arrays(fig.to_plotly_json()),
+                                    validate=False),
+                repeats)
+            stages['views'][graph] = {
+                'figure_s': figure_time,
+                'json_s': json_time,
+                'json_bytes': len(payload),
+                'typed_s': typed_time,
+                'typed_bytes': len(typed_payload),
+                'traces': len(fig.data),
+            }
+        results['selections'][name] = stages
+    return results
+
+
+def bench_size(m_i_step, repeats, work_dir):
+    database = os.path.join(work_dir, 'sdb_grid.db')
+    snapshot = os.path.join(work_dir, 'snapshot')
+    start = time.perf_counter()
+    write_database(synthetic_models(m_i_step), database, force=True)
+    generate_time = time.perf_counter() - start
+
+    env = dict(os.environ, SDB_GRID_DATABASE=database,
+               SDB_GRID_SNAPSHOT=snapshot)
+    cold_import = time_import(env)
+    warm_import = min(time_import(env) for _ in range(repeats))
+    result = subprocess.run(
+        [sys.executable, __file__, '--measure', '--repeats', str(repeats)],
+        cwd=repo_dir, env=env, check=True, capture_output=True, text=True)
+    results = json.loads(result.stdout)
+    results.update({
+        'm_i_step': m_i_step,
+        'generate_s': generate_time,
+        'import_cold_s': cold_import,
+        'import_warm_s': warm_import,
+    })
+    return results
+
+
+def environment():
+    import numpy
+    import pandas
+    import plotly
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo_dir,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': numpy.__version__,
+        'pandas': pandas.__version__,
+        'plotly': plotly.__version__,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the viewer on synthetic grids.')
+    parser.add_argument('--m-i-steps', type=float, nargs='+',
+                        default=[0.05, 0.02, 0.01, 0.005],
+                        help='initial mass steps of the benchmarked grids')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('-o', '--output', default='bench_results.json')
+    parser.add_argument('--measure', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        json.dump(measure(args.repeats), sys.stdout)
+        return
+
+    logging.basicConfig(level=logging.INFO)
+    runs = []
+    for m_i_step in args.m_i_steps:
+        with tempfile.TemporaryDirectory() as work_dir:
+            runs.append(bench_size(m_i_step, args.repeats, work_dir))
+        logger.info('m_i step %g: %d models', m_i_step, runs[-1]['models'])
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(), 'runs': runs}, f, indent=2)
+    logger.info('Wrote %s', args.output)
+
+
+if __name__ == '__main__':
+    main()
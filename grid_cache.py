@@ -0,0 +1,79 @@
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+_missing = object()
+_caches = weakref.WeakSet()
+
+
+def _reset_locks():
+    # A lock held by another thread when a background job is forked
+    # would never be released in the job.
+    for cache in list(_caches):
+        cache._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_locks)
+
+
+class LRUCache:
+    """Thread-safe mapping that evicts the least recently used entries.
+
+    The cache is bounded by the number of entries and, optionally, by the
+    total size of the stored values as reported by `sizeof`.
+    """
+
+    def __init__(self, maxsize=128, maxbytes=None, sizeof=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof or (lambda value: getattr(value, 'nbytes', 0))
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        _caches.add(self)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key][0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self.nbytes -= self._data.pop(key)[1]
+            self._data[key] = (value, size)
+            self.nbytes += size
+            while self._data and (
+                    len(self._data) > self.maxsize
+                    or (self.maxbytes is not None
+                        and self.nbytes > self.maxbytes)):
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self.nbytes -= evicted_size
+
+    def items(self):
+        """Return the cached `(key, value)` pairs, least recent first."""
+        with self._lock:
+            return [(key, value) for key, (value, _) in self._data.items()]
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key, _missing)
+        if value is _missing:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
@@ -0,0 +1,64 @@
+import hashlib
+
+import numpy as np
+
+from grid_index import grid_parameters
+
+client_columns = ['Teff', 'log_g', 'L', 'radius']
+
+# Little-endian, as read by JavaScript typed arrays on all common platforms.
+code_types = {'uint8': '<u1', 'uint16': '<u2'}
+
+_missing = np.iinfo(np.uint16).max
+
+
+def quantize(values):
+    """Encode floats as uint16 fixed point: `zero + scale * code`.
+
+    The largest code marks missing values.
+    """
+    values = np.asarray(values, dtype=float)
+    finite = np.isfinite(values)
+    if finite.any():
+        zero, top = values[finite].min(), values[finite].max()
+    else:
+        zero, top = 0.0, 0.0
+    scale = (top - zero) / (_missing - 1) or 1.0
+    codes = np.full(len(values), _missing, dtype=np.uint16)
+    codes[finite] = np.rint((values[finite] - zero) / scale)
+    return codes, float(zero), float(scale)
+
+
+def build_client_grid(df, columns=None):
+    """Pack the grid for the browser as one little-endian buffer.
+
+    Grid parameters are sent as uint8 codes into their sorted values and
+    `columns` as uint16 fixed point. Returns the buffer and a manifest
+    with the layout of the buffer and its content hash.
+    """
+    parts, offset = [], 0
+    manifest = {'rows': len(df), 'columns': []}
+    for name in grid_parameters + list(columns or client_columns):
+        values = df[name].to_numpy(dtype=float)
+        if name in grid_parameters:
+            axis, codes = np.unique(values, return_inverse=True)
+            dtype = 'uint8' if len(axis) <= 256 else 'uint16'
+            codes = codes.ravel().astype(code_types[dtype])
+            column = {'name': name, 'dtype': dtype, 'values': axis.tolist()}
+        else:
+            codes, zero, scale = quantize(values)
+            codes = codes.astype(code_types['uint16'])
+            column = {'name': name, 'dtype': 'uint16',
+                      'zero': zero, 'scale': scale}
+        # Typed arrays need offsets aligned to their element size.
+        padding = -offset % 4
+        parts.append(b'\0' * padding)
+        offset += padding
+        column['offset'] = offset
+        parts.append(codes.tobytes())
+        offset += codes.nbytes
+        manifest['columns'].append(column)
+    payload = b''.join(parts)
+    manifest['hash'] = hashlib.sha1(payload).hexdigest()[:16]
+    manifest['bytes'] = len(payload)
+    return payload, manifest
@@ -0,0 +1,239 @@
+import itertools
+import logging
+
+import numpy as np
+import pandas as pd
+
+from grid_cache import LRUCache
+from grid_index import grid_parameters
+
+logger = logging.getLogger(__name__)
+
+interpolated_columns = ['Teff', 'log_g', 'L', 'radius', 'age', 'm_he_core',
+                        'y_i', 'z_surf', 'y_surf', 'center_he4']
+summary_columns = ['Teff', 'log_g', 'L', 'radius', 'age', 'm_he_core']
+
+# How the statistics of two parts of a cell are combined.
+_reductions = {'models': 'sum', 'count': 'sum', 'sum': 'sum', 'min': 'min',
+               'max': 'max'}
+
+
+def _slices(parameters, axes, ranges):
+    """Return the block of cells with every parameter in its range."""
+    slices = []
+    for name, axis in zip(parameters, axes):
+        if name not in ranges:
+            slices.append(slice(None))
+            continue
+        low, high = ranges[name]
+        slices.append(slice(np.searchsorted(axis, low, side='left'),
+                            np.searchsorted(axis, high, side='right')))
+    return tuple(slices)
+
+
+class GridCube:
+    """Dense view of the models over the axes of the grid parameters.
+
+    `rows` holds the position of the model in every cell of the
+    z_i x m_i x m_env x y_c grid, or -1 where the model is missing. Dense
+    arrays of the other columns are built on demand.
+    """
+
+    def __init__(self, df, parameters=None, maxsize=16):
+        self.df = df
+        self.parameters = list(parameters or grid_parameters)
+        self.axes = []
+        codes = []
+        for name in self.parameters:
+            values, inverse = np.unique(df[name].to_numpy(dtype=float),
+                                        return_inverse=True)
+            self.axes.append(values)
+            codes.append(inverse.ravel())
+        self.shape = tuple(len(axis) for axis in self.axes)
+        self.rows = np.full(self.shape, -1, dtype=np.intp)
+        self.rows[tuple(codes)] = np.arange(len(df))
+        filled = np.count_nonzero(self.rows >= 0)
+        if filled < len(df):
+            logger.warning('%d models share grid cells with other models',
+                           len(df) - filled)
+        self.mask = self.rows >= 0
+        self._values = LRUCache(maxsize=maxsize)
+
+    def values(self, column):
+        """Return the dense array of `column`, NaN for missing models."""
+        def build():
+            dense = np.full(self.shape, np.nan)
+            dense[self.mask] = self.df[column].to_numpy(
+                dtype=float)[self.rows[self.mask]]
+            dense.flags.writeable = False
+            return dense
+
+        return self._values.get_or_compute(column, build)
+
+    def select(self, ranges):
+        """Return the sorted row positions with every parameter in range."""
+        rows = self.rows[_slices(self.parameters, self.axes, ranges)].ravel()
+        return np.sort(rows[rows >= 0])
+
+    def interpolate(self, points, columns=None):
+        """Interpolate `columns` multilinearly at the parameter `points`.
+
+        `points` is an array of shape (n, 4) in the order of `parameters`.
+        Points outside the grid, or next to a missing model, give NaN.
+        Returns a mapping of the column names to arrays of length n.
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        lower, weights = [], []
+        inside = np.ones(len(points), dtype=bool)
+        for i, axis in enumerate(self.axes):
+            x = points[:, i]
+            inside &= (x >= axis[0]) & (x <= axis[-1])
+            if len(axis) == 1:
+                lower.append(np.zeros(len(points), dtype=np.intp))
+                weights.append(np.zeros(len(points)))
+                continue
+            j = np.clip(np.searchsorted(axis, x, side='right') - 1,
+                        0, len(axis) - 2)
+            lower.append(j)
+            weights.append(np.clip((x - axis[j]) / (axis[j + 1] - axis[j]),
+                                   0.0, 1.0))
+
+        columns = list(columns or interpolated_columns)
+        result = {name: np.zeros(len(points)) for name in columns}
+        for corner in itertools.product((0, 1), repeat=len(self.axes)):
+            index, weight = [], np.ones(len(points))
+            for i, step in enumerate(corner):
+                w = weights[i] if step else 1.0 - weights[i]
+                index.append(np.minimum(lower[i] + step, self.shape[i] - 1))
+                weight *= w
+            index = tuple(index)
+            used = weight > 0
+            for name in columns:
+                corner_values = self.values(name)[index]
+                result[name] += np.where(used, weight * corner_values, 0.0)
+                # A missing corner that carries weight spoils the point.
+                result[name][used & np.isnan(corner_values)] = np.nan
+        for name in columns:
+            result[name][~inside] = np.nan
+        return result
+
+    def curve(self, point, vary, samples=200, columns=None):
+        """Interpolate along one parameter, keeping the others at `point`.
+
+        `point` maps the parameter names to values; `vary` is swept over
+        its whole axis. Returns the swept values and the interpolation.
+        """
+        i = self.parameters.index(vary)
+        sweep = np.linspace(self.axes[i][0], self.axes[i][-1], samples)
+        points = np.tile([point[name] for name in self.parameters],
+                         (samples, 1)).astype(float)
+        points[:, i] = sweep
+        return sweep, self.interpolate(points, columns)
+
+
+class SummaryCube:
+    """Counts, sums and extremes of the models in every grid cell.
+
+    A cell holds the models of one z_i, m_i, m_env and y_c value, any
+    number of them. The cube is aggregated from chunks of models, so the
+    models never need to be in memory at once, and the statistics of a
+    slider selection are reduced from its block of cells.
+    """
+
+    def __init__(self, chunks, columns=None, parameters=None, cells=None):
+        self.parameters = list(parameters or grid_parameters)
+        self.columns = list(columns or summary_columns)
+        for chunk in chunks:
+            cells = self._merged(cells, self._aggregated(chunk))
+        self.cells = cells
+
+        index = cells['models'].index
+        levels = [index.get_level_values(name).to_numpy(dtype=float)
+                  for name in self.parameters]
+        self.axes = [np.unique(values) for values in levels]
+        self.shape = tuple(len(axis) for axis in self.axes)
+        cell = tuple(np.searchsorted(axis, values)
+                     for axis, values in zip(self.axes, levels))
+        self.models = np.zeros(self.shape, dtype=np.int64)
+        self.models[cell] = cells['models'].to_numpy()
+        shape = self.shape + (len(self.columns),)
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.sum = np.zeros(shape)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+        for statistic in ('count', 'sum', 'min', 'max'):
+            getattr(self, statistic)[cell] = cells[statistic].to_numpy()
+
+    def _aggregated(self, chunk):
+        # The parameters are categoricals in the compact mode, whose unused
+        # combinations must not become empty cells.
+        grouped = chunk.groupby(self.parameters, observed=True)
+        cells = {statistic: getattr(grouped[self.columns], statistic)()
+                 for statistic in ('count', 'sum', 'min', 'max')}
+        cells['models'] = grouped.size()
+        return cells
+
+    def _merged(self, cells, new):
+        if cells is None:
+            return new
+        return {statistic: getattr(
+            pd.concat([cells[statistic], new[statistic]])
+            .groupby(level=self.parameters, observed=True), reduction)()
+            for statistic, reduction in _reductions.items()}
+
+    def extended(self, chunks):
+        """Return the cube with the models of `chunks` added."""
+        return SummaryCube(chunks, self.columns, self.parameters, self.cells)
+
+    def _block(self, ranges):
+        return _slices(self.parameters, self.axes, ranges)
+
+    def statistics(self, ranges):
+        """Return the number of selected models and their statistics.
+
+        The statistics are a data frame of the count, mean, min and max of
+        every column, NaN where no value was selected.
+        """
+        block = self._block(ranges)
+        cells = tuple(range(len(self.parameters)))
+        count = self.count[block].sum(axis=cells)
+        selected = count > 0
+        with np.errstate(invalid='ignore'):
+            mean = self.sum[block].sum(axis=cells) / count
+        statistics = pd.DataFrame({
+            'count': count,
+            'mean': mean,
+            'min': np.where(selected, self.min[block].min(
+                axis=cells, initial=np.inf), np.nan),
+            'max': np.where(selected, self.max[block].max(
+                axis=cells, initial=-np.inf), np.nan),
+        }, index=self.columns)
+        return int(self.models[block].sum()), statistics
+
+    def marginals(self, ranges):
+        """Return the number of selected models at every parameter value.
+
+        Maps the parameter names to their values inside the selection and
+        the model counts.
+        """
+        block = self._block(ranges)
+        models = self.models[block]
+        cells = set(range(len(self.parameters)))
+        return {name: (axis[block[i]],
+                       models.sum(axis=tuple(cells - {i})))
+                for i, (name, axis) in enumerate(zip(self.parameters,
+                                                     self.axes))}
+
+    def histogram(self, ranges, column, bins=30):
+        """Return the histogram of `column` over the selected models.
+
+        Every cell adds its count at its mean, which is exact while the
+        cells hold a single model each. Returns the counts and the bin
+        edges.
+        """
+        j = self.columns.index(column)
+        block = self._block(ranges)
+        count = self.count[block][..., j].ravel()
+        used = count > 0
+        mean = self.sum[block][..., j].ravel()[used] / count[used]
+        return np.histogram(mean, bins=bins, weights=count[used])
@@ -0,0 +1,336 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from sqlalchemy import create_engine, inspect, text
+
+from grid_index import grid_parameters
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+database = os.environ.get('SDB_GRID_DATABASE', 'data/sdb_grid.db')
+snapshot_dir = os.environ.get('SDB_GRID_SNAPSHOT', 'data/snapshot')
+compact = os.environ.get('SDB_GRID_COMPACT', '0') == '1'
+reload_interval = float(os.environ.get('SDB_GRID_RELOAD_INTERVAL', 0))
+
+cols_to_remove = ['rot_i', 'rot', 'fh', 'fhe', 'fsh', 'mlt', 'sc', 'reimers',
+                  'blocker', 'turbulence', 'model_number', 'level',
+                  'log_Teff', 'log_L', 'top_dir', 'log_dir']
+
+
+def read_models(database=database, after_id=None):
+    """Read the `models` table and apply the viewer's column transforms.
+
+    Only the columns kept by the viewer are read from the database. With
+    `after_id`, only the models with a larger id are read.
+    """
+    engine = create_engine(f'sqlite:///{database}')
+    names = [column['name'] for column in inspect(engine).get_columns('models')
+             if column['name'] not in cols_to_remove]
+    query = 'SELECT {} FROM models'.format(
+        ', '.join(f'"{name}"' for name in names + ['log_Teff', 'log_L']))
+    params = {}
+    if after_id is not None:
+        query += ' WHERE id > :after_id ORDER BY id'
+        params['after_id'] = int(after_id)
+    df = pd.read_sql(text(query), engine, params=params)
+    engine.dispose()
+    df['Teff'] = 10.0 ** df['log_Teff']
+    df['L'] = 10.0 ** df['log_L']
+    df = df.drop(columns=['log_Teff', 'log_L'])
+    df.rename(columns={'custom_profile': 'y_c'}, inplace=True)
+    return df
+
+
+def _smallest_int(values):
+    if len(values) == 0:
+        return values
+    return values.astype(np.promote_types(np.min_scalar_type(values.min()),
+                                          np.min_scalar_type(values.max())))
+
+
+def compact_columns(data):
+    """Shrink a mapping of column arrays for keeping in memory.
+
+    Grid parameters become categoricals (small integer codes with a table
+    of their values), other floats are downcast to float32 and integers to
+    the smallest type holding their range.
+    """
+    compacted = {}
+    for name, values in data.items():
+        values = np.asarray(values)
+        if name in grid_parameters:
+            compacted[name] = pd.Categorical(values)
+        elif values.dtype.kind == 'f':
+            compacted[name] = values.astype(np.float32)
+        elif values.dtype.kind in 'iu':
+            compacted[name] = _smallest_int(values)
+        else:
+            compacted[name] = values
+    return compacted
+
+
+def append_models(df, new):
+    """Return `df` with the models of `new` appended, in the dtypes of `df`.
+
+    Categorical columns gain the new categories and integer columns are
+    widened if the new values do not fit.
+    """
+    data = {}
+    for name in df.columns:
+        old, added = df[name], new[name].to_numpy()
+        if isinstance(old.dtype, pd.CategoricalDtype):
+            data[name] = union_categoricals(
+                [old.array, pd.Categorical(added)], sort_categories=True)
+        elif old.dtype.kind in 'iu':
+            dtype = np.promote_types(old.dtype, _smallest_int(added).dtype)
+            data[name] = np.concatenate([old.to_numpy(), added]).astype(dtype)
+        else:
+            data[name] = np.concatenate(
+                [old.to_numpy(), added.astype(old.dtype)])
+    return pd.DataFrame(data)
+
+
+def float32_values(values):
+    """Return float32 values as floats of 7 significant digits.
+
+    Widened to float64 as they are, they would show spurious digits.
+    """
+    return [float(f'{value:.7g}') for value in values]
+
+
+def model_record(frame):
+    """Return the first row of `frame` as a dict of Python values.
+
+    Every column keeps its own type, so ids stay integers, and missing
+    values become None.
+    """
+    record = frame.iloc[:1].to_dict('records')[0]
+    for name in frame.columns[frame.dtypes == np.float32]:
+        record[name] = float32_values([record[name]])[0]
+    return {name: None if pd.isna(value) else value
+            for name, value in record.items()}
+
+
+def _log_memory(df, loaded_nbytes):
+    used = df.memory_usage(index=False).sum()
+    logger.info('Loaded %d models into %.1f MB (%.1f MB saved)', len(df),
+                used / 2 ** 20, (loaded_nbytes - used) / 2 ** 20)
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def database_signature(database=database):
+    stat = os.stat(database)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _manifest_path(snapshot_dir):
+    return Path(snapshot_dir) / 'manifest.json'
+
+
+def read_manifest(snapshot_dir=snapshot_dir):
+    try:
+        with _manifest_path(snapshot_dir).open('r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != SNAPSHOT_VERSION:
+        return None
+    return manifest
+
+
+def _write_manifest(snapshot_dir, manifest):
+    fd, tmp = tempfile.mkstemp(dir=snapshot_dir, suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, _manifest_path(snapshot_dir))
+
+
+def snapshot_is_current(manifest, database=database):
+    """Check a manifest against the database, by mtime first, then checksum.
+
+    A database that was only touched keeps its snapshot; the manifest is
+    refreshed with the new mtime so the checksum is not recomputed again.
+    """
+    if manifest is None:
+        return False
+    if not os.path.exists(database):
+        return True
+    signature = database_signature(database)
+    recorded = manifest['database']
+    if (signature['size'] == recorded['size']
+            and signature['mtime_ns'] == recorded['mtime_ns']):
+        return True
+    if signature['size'] != recorded['size']:
+        return False
+    if file_checksum(database) != recorded['sha1']:
+        return False
+    manifest['database'].update(signature)
+    return True
+
+
+def build_snapshot(database=database, snapshot_dir=snapshot_dir):
+    """Convert the `models` table into per-column `.npy` files.
+
+    Columns are written to a directory named after the database checksum
+    and `manifest.json` is swapped in last, so readers never see a partly
+    written snapshot.
+    """
+    snapshot_dir = Path(snapshot_dir)
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    signature = database_signature(database)
+    sha1 = file_checksum(database)
+    df = read_models(database)
+
+    tmp_dir = Path(tempfile.mkdtemp(dir=snapshot_dir, prefix='.build-'))
+    for name in df.columns:
+        np.save(tmp_dir / f'{name}.npy', df[name].to_numpy(),
+                allow_pickle=False)
+    data_dir = snapshot_dir / sha1[:16]
+    try:
+        os.rename(tmp_dir, data_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    manifest = {
+        'version': SNAPSHOT_VERSION,
+        'database': {'path': str(database), 'sha1': sha1, **signature},
+        'data_dir': data_dir.name,
+        'rows': len(df),
+        'columns': [{'name': name, 'dtype': str(df[name].dtype)}
+                    for name in df.columns],
+    }
+    _write_manifest(snapshot_dir, manifest)
+
+    for path in snapshot_dir.iterdir():
+        if path.is_dir() and path.name != data_dir.name \
+                and not path.name.startswith('.build-'):
+            shutil.rmtree(path, ignore_errors=True)
+
+    logger.info('Built snapshot of %d models in %s', len(df), data_dir)
+    return manifest
+
+
+def load_snapshot(manifest, snapshot_dir=snapshot_dir, mmap_mode=None,
+                  compact=False):
+    data_dir = Path(snapshot_dir) / manifest['data_dir']
+    data = {column['name']: np.load(data_dir / f'{column["name"]}.npy',
+                                    mmap_mode=mmap_mode, allow_pickle=False)
+            for column in manifest['columns']}
+    if not compact:
+        # One block per column keeps memory-mapped columns zero-copy, so
+        # every process reading the snapshot shares the same pages.
+        return pd.DataFrame(data, copy=False)
+    # Converting the memory-mapped columns avoids a full float64 copy.
+    df = pd.DataFrame(compact_columns(data))
+    _log_memory(df, sum(values.nbytes for values in data.values()))
+    return df
+
+
+def load_models(database=database, snapshot_dir=snapshot_dir, mmap_mode='r',
+                compact=compact):
+    """Load the grid from its snapshot, rebuilding it if the database changed.
+
+    Without a snapshot directory (`snapshot_dir=None`) the table is read
+    straight from the database. With `compact`, the columns are shrunk by
+    `compact_columns`.
+    """
+    if snapshot_dir is None:
+        df = read_models(database)
+        if not compact:
+            return df
+        loaded_nbytes = df.memory_usage(index=False).sum()
+        df = pd.DataFrame(compact_columns(
+            {name: df[name].to_numpy() for name in df.columns}))
+        _log_memory(df, loaded_nbytes)
+        return df
+    manifest = read_manifest(snapshot_dir)
+    recorded = dict(manifest['database']) if manifest else None
+    if not snapshot_is_current(manifest, database):
+        manifest = build_snapshot(database, snapshot_dir)
+    elif manifest['database'] != recorded:
+        try:
+            _write_manifest(snapshot_dir, manifest)
+        except OSError:
+            pass
+    return load_snapshot(manifest, snapshot_dir, mmap_mode=mmap_mode,
+                         compact=compact)
+
+
+class DatabaseWatcher:
+    """Background thread calling `on_change` when the database changes.
+
+    The database signature is polled every `interval` seconds. Threads do
+    not survive a fork, so `start` is called in every process and starts
+    one thread per process. A failed `on_change` is retried at the next
+    poll.
+    """
+
+    def __init__(self, on_change, database=database,
+                 interval=reload_interval):
+        self.on_change = on_change
+        self.database = database
+        self.interval = interval
+        self.signature = database_signature(database)
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name='database-watcher',
+                         daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                signature = database_signature(self.database)
+                if signature != self.signature:
+                    self.on_change()
+                    self.signature = signature
+            except Exception:
+                logger.exception('Reloading %s failed', self.database)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Build the columnar snapshot of the sdB grid.')
+    parser.add_argument('--database', default=database)
+    parser.add_argument('--snapshot', default=snapshot_dir)
+    parser.add_argument('--force', action='store_true',
+                        help='rebuild even if the snapshot is current')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    manifest = read_manifest(args.snapshot)
+    if args.force or not snapshot_is_current(manifest, args.database):
+        build_snapshot(args.database, args.snapshot)
+    else:
+        _write_manifest(args.snapshot, manifest)
+        logger.info('Snapshot in %s is current', args.snapshot)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from grid_cube import GridCube, SummaryCube
+from grid_data import append_models, model_record
+from grid_derived import DerivedColumns
+from grid_index import GridIndex, TrackIndex
+from grid_match import TargetMatcher
+
+logger = logging.getLogger(__name__)
+
+
+def sample_priority(size, seed=0):
+    """Fixed random priorities of the models for `decimate`."""
+    return np.random.default_rng(seed).random(size)
+
+
+class GridDataset:
+    """One version of the in-memory grid together with its indexes.
+
+    A version is not modified once built. Models added to the database
+    give a new version through `extended`, while the requests that still
+    hold the old one finish with it.
+    """
+
+    def __init__(self, df, version=0, grid_index=None, priority=None,
+                 derived_columns=None, summary=None):
+        self.df = df
+        self.version = version
+        self.max_id = int(df['id'].max()) if len(df) else None
+        self.grid_index = grid_index or GridIndex(df)
+        self.track_index = TrackIndex(df)
+        self.cube = GridCube(df)
+        self.summary = summary or SummaryCube([df])
+        self.priority = (sample_priority(len(df)) if priority is None
+                         else priority)
+        self.matcher = TargetMatcher(df)
+        self.derived_columns = derived_columns or DerivedColumns(df)
+        self.ids = pd.Index(df['id'])
+
+    def __len__(self):
+        return len(self.df)
+
+    def row(self, model_id):
+        """Return the model with `model_id` as a dict, or None."""
+        position = self.ids.get_indexer([model_id])[0]
+        if position < 0:
+            return None
+        return model_record(self.df.iloc[position:position + 1])
+
+    def extended(self, new):
+        """Return the next version, with the models of `new` appended.
+
+        The existing models keep their row positions. The slider index,
+        the sampling priorities and the cached derived columns are only
+        computed for the new models, which are also added to the summary
+        cube; the tracks, the grid cube and the k-d tree of the matcher
+        depend on all models and are rebuilt.
+        """
+        df = append_models(self.df, new)
+        added = df.iloc[len(self.df):]
+        dataset = GridDataset(
+            df, self.version + 1,
+            grid_index=self.grid_index.extended(added),
+            priority=np.concatenate([
+                self.priority, sample_priority(len(added), seed=len(df))]),
+            derived_columns=self.derived_columns.extended(df),
+            summary=self.summary.extended([added]))
+        logger.info('Added %d models, %d in total', len(added), len(df))
+        return dataset
@@ -0,0 +1,126 @@
+import ast
+import operator
+import os
+
+import numpy as np
+
+from grid_cache import LRUCache
+
+functions = {
+    'log10': np.log10,
+    'log': np.log,
+    'exp': np.exp,
+    'exp10': lambda values: 10.0 ** values,
+    'sqrt': np.sqrt,
+    'abs': np.abs,
+}
+
+_binary = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Pow: operator.pow,
+}
+
+_unary = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+
+class DerivedColumns:
+    """Arithmetic expressions over the grid columns, evaluated on demand.
+
+    An expression such as `log10(L) / radius**2` may use the columns of
+    `df`, numbers, `+ - * / **` and the functions in `functions`. It is
+    evaluated over the whole grid once and kept in an LRU cache keyed by
+    its normalized form.
+    """
+
+    def __init__(self, df, maxsize=32, maxbytes=None):
+        self.df = df
+        if maxbytes is None:
+            maxbytes = int(os.environ.get('SDB_GRID_DERIVED_CACHE_MB',
+                                          128)) * 2 ** 20
+        self.cache = LRUCache(maxsize=maxsize, maxbytes=maxbytes)
+
+    def parse(self, expression):
+        """Return the normalized expression, or raise ValueError."""
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+        except SyntaxError:
+            raise ValueError(f'Invalid expression: {expression}') from None
+        callees = {id(node.func) for node in ast.walk(tree)
+                   if isinstance(node, ast.Call)}
+        for node in ast.walk(tree):
+            self._check(node, id(node) in callees)
+        return ast.unparse(tree)
+
+    def _check(self, node, callee=False):
+        if isinstance(node, (ast.Expression, ast.Load)) \
+                or type(node) in _binary or type(node) in _unary:
+            return
+        if isinstance(node, ast.Name):
+            if not callee and node.id not in self.df.columns:
+                raise ValueError(f'Unknown column: {node.id}')
+        elif isinstance(node, ast.Constant):
+            if not isinstance(node.value, (int, float)) \
+                    or isinstance(node.value, bool):
+                raise ValueError(f'Unsupported constant: {node.value!r}')
+        elif isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) \
+                    or node.func.id not in functions \
+                    or len(node.args) != 1 or node.keywords:
+                raise ValueError('Functions take one argument and must be '
+                                 f'one of {", ".join(functions)}')
+        elif not isinstance(node, (ast.BinOp, ast.UnaryOp)):
+            raise ValueError(
+                f'Unsupported syntax: {type(node).__name__}')
+        elif isinstance(node, ast.BinOp) and type(node.op) not in _binary \
+                or isinstance(node, ast.UnaryOp) \
+                and type(node.op) not in _unary:
+            raise ValueError('Only + - * / ** are supported')
+
+    def _evaluate(self, node):
+        if isinstance(node, ast.Expression):
+            return self._evaluate(node.body)
+        if isinstance(node, ast.Name):
+            return self.df[node.id].to_numpy(dtype=float)
+        if isinstance(node, ast.Constant):
+            return np.float64(node.value)
+        if isinstance(node, ast.Call):
+            return functions[node.func.id](self._evaluate(node.args[0]))
+        if isinstance(node, ast.UnaryOp):
+            return _unary[type(node.op)](self._evaluate(node.operand))
+        return _binary[type(node.op)](self._evaluate(node.left),
+                                      self._evaluate(node.right))
+
+    def extended(self, df):
+        """Return the derived columns of `df`, this grid with models appended.
+
+        Cached expressions are carried over and only evaluated for the new
+        models.
+        """
+        extended = DerivedColumns(df, self.cache.maxsize, self.cache.maxbytes)
+        added = DerivedColumns(df.iloc[len(self.df):], maxbytes=0)
+        for key, values in self.cache.items():
+            values = np.concatenate([values, added.values(key)])
+            values.flags.writeable = False
+            extended.cache.put(key, values)
+        return extended
+
+    def values(self, expression):
+        """Return the read-only values of `expression` for every model."""
+        key = self.parse(expression)
+
+        def compute():
+            with np.errstate(divide='ignore', invalid='ignore',
+                             over='ignore'):
+                values = self._evaluate(ast.parse(key, mode='eval'))
+            values = np.broadcast_to(np.asarray(values, dtype=float),
+                                     (len(self.df),)).copy()
+            values.flags.writeable = False
+            return values
+
+        return self.cache.get_or_compute(key, compute)
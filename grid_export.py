@@ -0,0 +1,59 @@
+import io
+
+export_formats = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+chunk_size = 50_000
+
+
+def frame_chunks(df, rows, columns, chunk_size=chunk_size):
+    """Yield the `columns` of `rows`, one chunk of rows at a time."""
+    for start in range(0, max(len(rows), 1), chunk_size):
+        yield df.iloc[rows[start:start + chunk_size]][columns]
+
+
+def csv_chunks(chunks):
+    """Yield data frame chunks as CSV text."""
+    for i, chunk in enumerate(chunks):
+        yield chunk.to_csv(index=False, header=i == 0)
+
+
+def parquet_chunks(chunks):
+    """Yield a Parquet file of data frame chunks, one row group at a time.
+
+    Requires pyarrow.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = io.BytesIO()
+    writer = None
+    for chunk in chunks:
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema)
+        writer.write_table(table)
+        yield _drain(sink)
+    writer.close()
+    yield _drain(sink)
+
+
+def _drain(buffer):
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+
+def parse_range(text):
+    """Parse a `low,high` query parameter."""
+    low, high = (float(value) for value in text.split(','))
+    return [low, high]
+
+
+def export_chunks(chunks, export_format):
+    """Return the generator of `export_format` over data frame chunks."""
+    if export_format == 'parquet':
+        return parquet_chunks(chunks)
+    return csv_chunks(chunks)
@@ -0,0 +1,302 @@
+import base64
+import os
+
+import numpy as np
+import plotly.graph_objects as go
+
+max_points = int(os.environ.get('SDB_GRID_MAX_POINTS', 100_000))
+# With SDB_GRID_LAZY_HOVER=1 the points only carry their id; the other
+# columns of a hovered model are fetched on demand.
+lazy_hover = os.environ.get('SDB_GRID_LAZY_HOVER', '0') == '1'
+# With SDB_GRID_TYPED_ARRAYS=1 the numeric arrays of the figures are sent
+# as base64 typed arrays, decoded by `assets/typed_arrays.js`.
+typed_arrays = os.environ.get('SDB_GRID_TYPED_ARRAYS', '0') == '1'
+density_bins = (200, 200)
+
+symbol_sequence = ['circle', 'diamond', 'square', 'x', 'cross']
+symbol_numbers = np.array([0, 2, 1, 4, 3])
+
+
+def _format_values(values, limit=4):
+    labels = [f'{value:g}' for value in values[:limit]]
+    if len(values) > limit:
+        labels.append(f'... ({len(values)} values)')
+    return ', '.join(labels)
+
+
+def symbol_legend(name, values):
+    """Return legend-only traces describing a cycled symbol mapping.
+
+    Values share symbols the same way as in Plotly Express, so each entry
+    lists every value drawn with its symbol.
+    """
+    traces = []
+    for i, symbol in enumerate(symbol_sequence[:len(values)]):
+        shared = values[i::len(symbol_sequence)]
+        traces.append({
+            'type': 'scattergl',
+            'x': [None],
+            'y': [None],
+            'mode': 'markers',
+            'marker': {'symbol': symbol, 'color': '#444'},
+            'name': f'{name} = {_format_values(shared)}',
+            'showlegend': True,
+            'hoverinfo': 'skip',
+        })
+    return traces
+
+
+def _hover_format(series):
+    # float32 values print with spurious digits once widened to float64.
+    if series.dtype == np.float32 \
+            or (typed_arrays and series.dtype.kind == 'f'):
+        return ':.7~g'
+    return ''
+
+
+def hover_label(name, axis, values):
+    """Return the hover line of an axis, e.g. `Teff=%{x}`."""
+    return f'{name}=%{{{axis}{_hover_format(values)}}}'
+
+
+def scatter_figure(dff, x, y, color, symbol, hover_data):
+    """Draw the models as one WebGL trace with per-point colors and symbols.
+
+    Unlike `px.scatter`, which adds one trace per symbol group, the number
+    of traces does not depend on the grouping columns.
+    """
+    symbol_values, symbol_codes = np.unique(dff[symbol].to_numpy(),
+                                            return_inverse=True)
+    hovertemplate = '<br>'.join(
+        [hover_label(x, 'x', dff[x]), hover_label(y, 'y', dff[y])])
+    if lazy_hover:
+        customdata = dff['id'].to_numpy()
+        hovertemplate += '<br>id=%{customdata}'
+    else:
+        hover_columns = [name for name in dict.fromkeys(
+            [color, symbol] + list(hover_data or [])) if name not in (x, y)]
+        customdata = np.column_stack(
+            [dff[name].to_numpy() for name in hover_columns]
+            or [np.empty((len(dff), 0))])
+        hovertemplate = '<br>'.join(
+            [hovertemplate]
+            + [f'{name}=%{{customdata[{i}]{_hover_format(dff[name])}}}'
+               for i, name in enumerate(hover_columns)])
+
+    points = {
+        'type': 'scattergl',
+        'x': dff[x].to_numpy(),
+        'y': dff[y].to_numpy(),
+        'mode': 'markers',
+        'marker': {
+            'color': dff[color].to_numpy(),
+            'coloraxis': 'coloraxis',
+            'symbol': symbol_numbers[symbol_codes % len(symbol_numbers)],
+        },
+        'customdata': customdata,
+        'hovertemplate': hovertemplate + '<extra></extra>',
+        'showlegend': False,
+        'meta': 'points',
+    }
+    # Per-point arrays make trace validation prohibitively slow.
+    fig = go.Figure(data=[points] + symbol_legend(symbol, symbol_values),
+                    _validate=False)
+    fig.update_layout(
+        xaxis_title=x,
+        yaxis_title=y,
+        coloraxis={'colorbar': {'title': {'text': color}}},
+        legend={'title': {'text': symbol},
+                'itemclick': False,
+                'itemdoubleclick': False},
+    )
+    return fig
+
+
+def track_values(values, breaks):
+    """Insert the gaps separating the tracks at `breaks`."""
+    return np.insert(np.asarray(values, dtype=float), breaks, np.nan)
+
+
+def track_trace(xs, ys, breaks):
+    """Draw all tracks as one line trace, separated by gaps at `breaks`."""
+    return {
+        'type': 'scattergl',
+        'x': track_values(xs, breaks),
+        'y': track_values(ys, breaks),
+        'mode': 'lines',
+        'line': {'color': 'rgba(120, 120, 120, 0.6)', 'width': 1},
+        'connectgaps': False,
+        'hoverinfo': 'skip',
+        'showlegend': False,
+        'meta': 'tracks',
+    }
+
+
+def _bin_edges(values, bins):
+    low, high = np.min(values), np.max(values)
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+    return np.linspace(low, high, bins + 1)
+
+
+def density_figure(dff, x, y, color=None, bins=density_bins):
+    """Bin the models into a 2D grid drawn as a heatmap.
+
+    Cells are colored by the mean of `color`, or by the number of models
+    when no color column is given.
+    """
+    xs = dff[x].to_numpy(dtype=float)
+    ys = dff[y].to_numpy(dtype=float)
+    finite = np.isfinite(xs) & np.isfinite(ys)
+    xs, ys = xs[finite], ys[finite]
+    nx, ny = bins
+    if len(xs):
+        x_edges, y_edges = _bin_edges(xs, nx), _bin_edges(ys, ny)
+    else:
+        x_edges, y_edges = np.linspace(0, 1, nx + 1), np.linspace(0, 1, ny + 1)
+
+    ix = np.clip(np.searchsorted(x_edges, xs, side='right') - 1, 0, nx - 1)
+    iy = np.clip(np.searchsorted(y_edges, ys, side='right') - 1, 0, ny - 1)
+    cells = iy * nx + ix
+    counts = np.bincount(cells, minlength=nx * ny).reshape(ny, nx)
+    if color is None:
+        z = np.where(counts > 0, counts, np.nan)
+        label = 'count'
+    else:
+        weights = dff[color].to_numpy(dtype=float)[finite]
+        sums = np.bincount(cells, weights=weights, minlength=nx * ny)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            z = sums.reshape(ny, nx) / counts
+        label = f'mean {color}'
+
+    x_centers = 0.5 * (x_edges[1:] + x_edges[:-1])
+    y_centers = 0.5 * (y_edges[1:] + y_edges[:-1])
+    density = {
+        'type': 'heatmap',
+        'x': x_centers,
+        'y': y_centers,
+        'z': z,
+        'customdata': counts,
+        'coloraxis': 'coloraxis',
+        'hovertemplate': '<br>'.join([
+            hover_label(x, 'x', x_centers), hover_label(y, 'y', y_centers),
+            f'{label}=%{{z{_hover_format(z)}}}',
+            'models=%{customdata}<extra></extra>']),
+    }
+    fig = go.Figure(data=[density], _validate=False)
+    fig.update_layout(
+        xaxis_title=x,
+        yaxis_title=y,
+        coloraxis={'colorbar': {'title': {'text': label}}},
+        annotations=[{
+            'text': f'{len(xs)} models shown as a density map',
+            'xref': 'paper', 'yref': 'paper', 'x': 0, 'y': 1.02,
+            'xanchor': 'left', 'yanchor': 'bottom', 'showarrow': False,
+        }],
+    )
+    return fig
+
+
+def models_figure(dff, x, y, color, symbol, hover_data):
+    """Plot individual models, or their density above `max_points`."""
+    if len(dff) > max_points:
+        return density_figure(dff, x, y, color)
+    return scatter_figure(dff, x, y, color, symbol, hover_data)
+
+
+def summary_figure(marginals, column, histogram):
+    """Plot the models at every grid parameter value over a histogram.
+
+    `marginals` maps the parameters to their values and model counts,
+    `histogram` holds the counts and bin edges of `column`. The axes are
+    laid out by hand, `make_subplots` alone would take most of the time
+    of an update while a slider is dragged.
+    """
+    gap = 0.04
+    width = (1 - gap * (len(marginals) - 1)) / len(marginals)
+    data = []
+    layout = {'height': 700, 'showlegend': False, 'bargap': 0.05}
+    for i, (name, (values, counts)) in enumerate(marginals.items()):
+        axis = str(i + 1) if i else ''
+        data.append(go.Bar(
+            x=values, y=counts, name=name, xaxis=f'x{axis}',
+            yaxis=f'y{axis}',
+            hovertemplate=f'{name}=%{{x}}<br>%{{y}} models<extra></extra>'))
+        left = i * (width + gap)
+        layout[f'xaxis{axis}'] = {'domain': [left, left + width],
+                                  'anchor': f'y{axis}', 'title': name}
+        layout[f'yaxis{axis}'] = {'domain': [0.58, 1], 'anchor': f'x{axis}'}
+    axis = str(len(marginals) + 1)
+    counts, edges = histogram
+    data.append(go.Bar(
+        x=(edges[:-1] + edges[1:]) / 2, y=counts, width=np.diff(edges),
+        name=column, xaxis=f'x{axis}', yaxis=f'y{axis}',
+        hovertemplate=f'{column}=%{{x:.4g}}<br>%{{y}} models<extra></extra>'))
+    layout[f'xaxis{axis}'] = {'domain': [0, 1], 'anchor': f'y{axis}',
+                              'title': column}
+    layout[f'yaxis{axis}'] = {'domain': [0, 0.42], 'anchor': f'x{axis}',
+                              'title': 'models'}
+    layout['yaxis']['title'] = 'models'
+    return go.Figure(data=data, layout=layout)
+
+
+_integer_types = [np.dtype(name) for name in
+                  ('<i1', '<u1', '<i2', '<u2', '<i4', '<u4')]
+
+
+def _typed_dtype(values):
+    if values.dtype.kind == 'f':
+        return np.dtype('<f4')
+    if values.dtype.kind == 'b' or not len(values):
+        return np.dtype('<u1')
+    low, high = values.min(), values.max()
+    return next((dtype for dtype in _integer_types
+                 if np.iinfo(dtype).min <= low
+                 and high <= np.iinfo(dtype).max), np.dtype('<f8'))
+
+
+def typed_array(values):
+    """Encode a numeric array as a plotly.js typed array specification.
+
+    Floats are sent as float32, integers as the smallest integer type
+    holding them. The bytes are encoded straight from the array buffer.
+    """
+    values = np.ascontiguousarray(values, dtype=_typed_dtype(values))
+    spec = {'dtype': values.dtype.str[1:],
+            'bdata': base64.b64encode(values).decode('ascii')}
+    if values.ndim > 1:
+        spec['shape'] = ','.join(map(str, values.shape))
+    return spec
+
+
+def _decoded(spec):
+    values = np.frombuffer(base64.b64decode(spec['bdata']),
+                           dtype=np.dtype(spec['dtype']).newbyteorder('<'))
+    if 'shape' in spec:
+        values = values.reshape(
+            [int(size) for size in str(spec['shape']).split(',')])
+    return values
+
+
+def encoded_arrays(value):
+    """Replace the numeric arrays nested in `value` by typed arrays."""
+    if isinstance(value, dict):
+        if 'bdata' not in value:
+            return {key: encoded_arrays(item) for key, item in value.items()}
+        # Already encoded by plotly >= 6, as float64.
+        value = _decoded(value)
+    if isinstance(value, np.ndarray) and value.dtype.kind in 'biuf':
+        return typed_array(value)
+    if isinstance(value, (list, tuple)):
+        return [encoded_arrays(item) for item in value]
+    return value
+
+
+def figure_response(fig):
+    """Return `fig` as sent by a callback, with typed arrays if enabled.
+
+    The figure is returned as a dict, which unlike a `go.Figure` is not
+    validated again when a background job result is unpickled.
+    """
+    figure = fig.to_plotly_json()
+    return encoded_arrays(figure) if typed_arrays else figure
@@ -0,0 +1,136 @@
+import argparse
+import csv
+import logging
+import multiprocessing
+import sys
+
+import numpy as np
+import pandas as pd
+
+from grid_data import database, load_models, snapshot_dir
+from grid_match import TargetMatcher, match_columns, match_count
+
+logger = logging.getLogger(__name__)
+
+model_columns = ['id', 'z_i', 'm_i', 'm_env', 'y_c'] + match_columns
+result_columns = ['target', 'rank', 'chi2'] + model_columns
+
+_worker = {}
+
+
+def read_targets(path_or_buffer):
+    """Read a catalog of targets from CSV.
+
+    Each observed column of `match_columns` needs a matching `<name>_err`
+    column; a `name` column, if present, labels the targets.
+    """
+    targets = pd.read_csv(path_or_buffer)
+    observed = [name for name in match_columns
+                if name in targets and f'{name}_err' in targets]
+    if not observed:
+        raise ValueError('catalog needs at least one of the column pairs '
+                         + ', '.join(f'{name}/{name}_err'
+                                     for name in match_columns))
+    if 'name' not in targets:
+        targets['name'] = targets.index.astype(str)
+    return targets[['name'] + [column for name in observed
+                               for column in (name, f'{name}_err')]]
+
+
+def _target(row):
+    target = {}
+    for name in match_columns:
+        value, error = row.get(name), row.get(f'{name}_err')
+        if pd.notna(value) and pd.notna(error) and error > 0:
+            target[name] = (value, error)
+    return target
+
+
+def fit_targets(df, matcher, targets, k=match_count):
+    """Return the `k` best models of every target, ranked by chi-square.
+
+    Targets without any value and error are skipped.
+    """
+    names, ranks, rows, chi2 = [], [], [], []
+    for row in targets.to_dict('records'):
+        target = _target(row)
+        if not target:
+            logger.warning('Skipping target %s without data', row['name'])
+            continue
+        best, best_chi2 = matcher.nearest(target, k)
+        names += [row['name']] * len(best)
+        ranks.append(np.arange(1, len(best) + 1))
+        rows.append(best)
+        chi2.append(best_chi2)
+    if not rows:
+        return pd.DataFrame(columns=result_columns)
+    result = df.iloc[np.concatenate(rows)][model_columns]
+    result.insert(0, 'chi2', np.concatenate(chi2))
+    result.insert(0, 'rank', np.concatenate(ranks))
+    result.insert(0, 'target', names)
+    return result.reset_index(drop=True)
+
+
+def _fit_chunk(args):
+    targets, k = args
+    return fit_targets(_worker['df'], _worker['matcher'], targets, k)
+
+
+def fit_catalog(targets, output, k=match_count, processes=None,
+                chunk_size=100, database=database, snapshot_dir=snapshot_dir):
+    """Fit a catalog in a process pool, writing CSV rows as chunks finish.
+
+    The grid and the k-d tree of the matcher are built once, before the
+    workers are forked: the memory-mapped snapshot columns are shared
+    through the page cache and the tree arrays copy-on-write, so only the
+    targets and the results are sent between processes. Returns the number
+    of rows written.
+    """
+    # Not compacted, which would copy every column out of the mapping.
+    df = load_models(database, snapshot_dir, mmap_mode='r', compact=False)
+    _worker['df'] = df
+    _worker['matcher'] = TargetMatcher(df)
+    chunks = [(targets.iloc[start:start + chunk_size], k)
+              for start in range(0, len(targets), chunk_size)]
+    writer = csv.writer(output)
+    writer.writerow(result_columns)
+    written = 0
+    with multiprocessing.get_context('fork').Pool(processes) as pool:
+        for i, result in enumerate(pool.imap(_fit_chunk, chunks)):
+            writer.writerows(result[result_columns].itertuples(index=False))
+            output.flush()
+            written += len(result)
+            logger.info('Fitted %d of %d chunks', i + 1, len(chunks))
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Fit a catalog of sdB stars against the grid.')
+    parser.add_argument('catalog',
+                        help='CSV file with the target values and errors')
+    parser.add_argument('-o', '--output',
+                        help='output CSV file (default: standard output)')
+    parser.add_argument('-k', '--matches', type=int, default=match_count,
+                        help='number of best models per target')
+    parser.add_argument('-j', '--processes', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=100)
+    parser.add_argument('--database', default=database)
+    parser.add_argument('--snapshot', default=snapshot_dir)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    targets = read_targets(args.catalog)
+    output = open(args.output, 'w', newline='') if args.output \
+        else sys.stdout
+    try:
+        written = fit_catalog(targets, output, args.matches, args.processes,
+                              args.chunk_size, args.database, args.snapshot)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    logger.info('Wrote %d matches for %d targets', written, len(targets))
+
+
+if __name__ == '__main__':
+    main()
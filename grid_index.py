@@ -0,0 +1,275 @@
+import numpy as np
+
+grid_parameters = ['z_i', 'm_i', 'm_env', 'y_c']
+
+
+class BitmapIndex:
+    """Packed bitset of the matching rows for every distinct value of a column.
+
+    A range query ORs the bitsets of the values inside the range, or, when
+    the range covers most of the values, ORs the remaining ones and inverts
+    the result.
+    """
+
+    def __init__(self, values):
+        values = np.asarray(values)
+        self.size = len(values)
+        self.values, codes = np.unique(values, return_inverse=True)
+        self.bitsets = np.empty((len(self.values), (self.size + 7) // 8),
+                                dtype=np.uint8)
+        for code in range(len(self.values)):
+            self.bitsets[code] = np.packbits(codes == code)
+
+    def mask(self, low, high):
+        """Return the packed mask of rows with `low <= value <= high`.
+
+        `None` means that every row matches.
+        """
+        selected = (self.values >= low) & (self.values <= high)
+        count = np.count_nonzero(selected)
+        if count == len(self.values):
+            return None
+        if count == 0:
+            return np.zeros(self.bitsets.shape[1], dtype=np.uint8)
+        if 2 * count <= len(self.values):
+            return np.bitwise_or.reduce(self.bitsets[selected], axis=0)
+        return ~np.bitwise_or.reduce(self.bitsets[~selected], axis=0)
+
+    def extended(self, values):
+        """Return the index with rows of `values` appended.
+
+        Only the bits of the new rows are computed; the bitsets of the
+        existing rows are copied, sharing the partly filled last byte.
+        """
+        values = np.asarray(values)
+        index = BitmapIndex.__new__(BitmapIndex)
+        index.size = self.size + len(values)
+        index.values = np.union1d(self.values, values)
+        old_codes = np.searchsorted(index.values, self.values)
+        codes = np.searchsorted(index.values, values)
+        used = self.size // 8
+        index.bitsets = np.zeros((len(index.values), (index.size + 7) // 8),
+                                 dtype=np.uint8)
+        index.bitsets[old_codes, :used] = self.bitsets[:, :used]
+        tail = self.size - 8 * used
+        for code in range(len(index.values)):
+            bits = codes == code
+            if tail:
+                old = np.zeros(tail, dtype=bool)
+                if code in old_codes:
+                    old = np.unpackbits(
+                        self.bitsets[np.searchsorted(old_codes, code), used:],
+                        count=tail).astype(bool)
+                bits = np.concatenate([old, bits])
+            index.bitsets[code, used:] = np.packbits(bits)
+        return index
+
+
+class GridIndex:
+    """Bitmap indexes over the discrete grid parameters of a data frame."""
+
+    def __init__(self, df, columns=None):
+        self.size = len(df)
+        self.bitmaps = {name: BitmapIndex(df[name].to_numpy())
+                        for name in (columns or grid_parameters)}
+
+    def extended(self, new):
+        """Return the index with the models of data frame `new` appended."""
+        index = GridIndex.__new__(GridIndex)
+        index.size = self.size + len(new)
+        index.bitmaps = {name: bitmap.extended(new[name].to_numpy())
+                         for name, bitmap in self.bitmaps.items()}
+        return index
+
+    def select(self, ranges):
+        """Return the sorted row positions matching all `(low, high)` ranges.
+
+        `ranges` maps a parameter name to its range; the ranges are ANDed.
+        """
+        bits = None
+        for name, (low, high) in ranges.items():
+            mask = self.bitmaps[name].mask(low, high)
+            if mask is None:
+                continue
+            if bits is None:
+                bits = mask
+            else:
+                np.bitwise_and(bits, mask, out=bits)
+        if bits is None:
+            return np.arange(self.size)
+        return np.flatnonzero(np.unpackbits(bits, count=self.size))
+
+
+class SpatialIndex:
+    """Uniform grid of buckets over two plotted columns for box queries.
+
+    Row positions are stored sorted by bucket, so the buckets overlapping a
+    box form one contiguous run per bucket row.
+    """
+
+    def __init__(self, xs, ys, bins=256):
+        self.xs = np.asarray(xs, dtype=float)
+        self.ys = np.asarray(ys, dtype=float)
+        self.bins = bins
+        finite = np.flatnonzero(np.isfinite(self.xs) & np.isfinite(self.ys))
+        self.x_edges = self._edges(self.xs[finite])
+        self.y_edges = self._edges(self.ys[finite])
+        cells = (self._bin(self.y_edges, self.ys[finite]) * bins
+                 + self._bin(self.x_edges, self.xs[finite]))
+        order = np.argsort(cells, kind='stable')
+        self.rows = finite[order]
+        self.offsets = np.searchsorted(cells[order],
+                                       np.arange(bins * bins + 1))
+
+    def _edges(self, values):
+        if len(values) == 0:
+            return np.linspace(0.0, 1.0, self.bins + 1)
+        low, high = values.min(), values.max()
+        if low == high:
+            low, high = low - 0.5, high + 0.5
+        return np.linspace(low, high, self.bins + 1)
+
+    def _bin(self, edges, values):
+        return np.clip(np.searchsorted(edges, values, side='right') - 1,
+                       0, self.bins - 1)
+
+    def query(self, x_range=None, y_range=None, rows=None):
+        """Return the sorted row positions inside the box.
+
+        A missing range is unbounded. If `rows` (sorted) is given, the result
+        is restricted to it.
+        """
+        x0, x1 = sorted(x_range) if x_range else (-np.inf, np.inf)
+        y0, y1 = sorted(y_range) if y_range else (-np.inf, np.inf)
+        ix0, ix1 = self._bin(self.x_edges, [x0, x1])
+        iy0, iy1 = self._bin(self.y_edges, [y0, y1])
+        first = np.arange(iy0, iy1 + 1) * self.bins
+        starts = self.offsets[first + ix0]
+        stops = self.offsets[first + ix1 + 1]
+        candidates = np.concatenate(
+            [self.rows[start:stop] for start, stop in zip(starts, stops)])
+        xs, ys = self.xs[candidates], self.ys[candidates]
+        found = np.sort(candidates[(xs >= x0) & (xs <= x1)
+                                   & (ys >= y0) & (ys <= y1)])
+        if rows is None or len(rows) == 0 or len(found) == 0:
+            return found if rows is None else found[:0]
+        positions = np.minimum(np.searchsorted(rows, found), len(rows) - 1)
+        return found[rows[positions] == found]
+
+
+class KDTree:
+    """Balanced k-d tree over a few columns for axis-aligned box queries.
+
+    Rows are reordered so that every node covers a contiguous run of them,
+    and each node keeps the bounding box of its rows, so a query either
+    skips a node, takes it whole or descends into it.
+    """
+
+    def __init__(self, points, leaf_size=256):
+        self.points = np.asarray(points, dtype=float)
+        self.rows = np.flatnonzero(np.isfinite(self.points).all(axis=1))
+        bounds = [(0, len(self.rows))]
+        lows, highs, children = [], [], []
+        node = 0
+        while node < len(bounds):
+            start, stop = bounds[node]
+            block = self.points[self.rows[start:stop]]
+            if len(block):
+                low, high = block.min(axis=0), block.max(axis=0)
+            else:
+                low = np.full(self.points.shape[1], np.inf)
+                high = np.full(self.points.shape[1], -np.inf)
+            lows.append(low)
+            highs.append(high)
+            dim = np.argmax(high - low) if len(block) else 0
+            if stop - start <= leaf_size or high[dim] == low[dim]:
+                children.append(-1)
+            else:
+                middle = (start + stop) // 2
+                order = np.argpartition(block[:, dim], middle - start)
+                self.rows[start:stop] = self.rows[start:stop][order]
+                children.append(len(bounds))
+                bounds += [(start, middle), (middle, stop)]
+            node += 1
+        self.bounds = np.array(bounds)
+        self.lows = np.array(lows)
+        self.highs = np.array(highs)
+        self.children = np.array(children)
+
+    def covers(self, low, high):
+        """Check whether the box contains every row of the tree."""
+        return bool((self.lows[0] >= low).all()
+                    and (self.highs[0] <= high).all())
+
+    def query(self, low, high):
+        """Return the sorted row positions with `low <= point <= high`.
+
+        Infinite bounds leave a column unconstrained.
+        """
+        low = np.asarray(low, dtype=float)
+        high = np.asarray(high, dtype=float)
+        found = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            node_low, node_high = self.lows[node], self.highs[node]
+            if (node_low > high).any() or (node_high < low).any():
+                continue
+            start, stop = self.bounds[node]
+            if (node_low >= low).all() and (node_high <= high).all():
+                found.append(self.rows[start:stop])
+            elif self.children[node] < 0:
+                rows = self.rows[start:stop]
+                block = self.points[rows]
+                found.append(rows[((block >= low) & (block <= high))
+                                  .all(axis=1)])
+            else:
+                stack += [self.children[node], self.children[node] + 1]
+        if not found:
+            return np.empty(0, dtype=np.intp)
+        return np.sort(np.concatenate(found))
+
+
+class TrackIndex:
+    """Grouping of the models into evolutionary tracks.
+
+    A track is the sequence of models sharing `columns`, ordered by
+    decreasing `order_by`, i.e. in the direction of evolution for the
+    central helium abundance.
+    """
+
+    def __init__(self, df, columns=('z_i', 'm_i', 'm_env'),
+                 order_by='center_he4'):
+        keys = [df[name].to_numpy(dtype=float) for name in columns]
+        self.order = np.lexsort([-df[order_by].to_numpy(dtype=float)]
+                                + keys[::-1])
+        ordered = np.stack([key[self.order] for key in keys])
+        starts = np.any(ordered[:, 1:] != ordered[:, :-1], axis=0)
+        self.track = np.empty(len(self.order), dtype=np.intp)
+        self.track[self.order] = np.cumsum(np.r_[0, starts])
+
+    def __len__(self):
+        return int(self.track.max()) + 1 if len(self.track) else 0
+
+    def lines(self, rows):
+        """Return `rows` in track order and the positions where tracks break.
+
+        The breaks can be passed to `np.insert` to separate the tracks.
+        """
+        selected = np.zeros(len(self.order), dtype=bool)
+        selected[rows] = True
+        ordered = self.order[selected[self.order]]
+        tracks = self.track[ordered]
+        return ordered, np.flatnonzero(tracks[1:] != tracks[:-1]) + 1
+
+
+def decimate(rows, budget, priority):
+    """Keep at most `budget` rows, preferring those with the lowest priority.
+
+    With a fixed random `priority`, points shown for a box stay shown for
+    any smaller box around them, so zooming in only adds points.
+    """
+    if len(rows) <= budget:
+        return rows
+    keep = np.argpartition(priority[rows], budget)[:budget]
+    return np.sort(rows[keep])
@@ -0,0 +1,127 @@
+import fcntl
+import os
+import time
+
+import dash
+
+# With SDB_GRID_BACKGROUND=1 the long callbacks run as background jobs;
+# this needs the extra packages of `pip install "dash[diskcache]"`.
+background_jobs = os.environ.get('SDB_GRID_BACKGROUND', '0') == '1'
+jobs_dir = os.environ.get('SDB_GRID_JOBS', 'data/jobs')
+job_workers = int(os.environ.get('SDB_GRID_JOB_WORKERS', 2))
+# Seconds a result is kept after it was last read.
+job_expire = int(os.environ.get('SDB_GRID_JOB_EXPIRE', 600))
+
+_report = None
+
+
+def report(message):
+    """Show `message` as the progress of the running background job.
+
+    Outside of a background job it does nothing.
+    """
+    if _report is not None:
+        _report(message)
+
+
+class GridJobManager(dash.DiskcacheManager):
+    """Run background callbacks in processes, with their results on disk.
+
+    Every job is a process forked from the worker, so it shares the grid
+    already in memory. At most `workers` jobs compute at the same time,
+    the others wait for a free slot. Identical requests of the same grid
+    version share one job and its result, and a job is only terminated
+    once no request is waiting for it any more.
+    """
+
+    def __init__(self, version, directory=jobs_dir, workers=job_workers,
+                 expire=job_expire):
+        import diskcache
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.workers = workers
+        super().__init__(diskcache.Cache(os.path.join(directory, 'results')),
+                         cache_by=[version], expire=expire)
+
+    @staticmethod
+    def _job_key(key):
+        return f'{key}-job'
+
+    @staticmethod
+    def _waiters_key(job):
+        return f'job-{job}-waiters'
+
+    def _forget(self, job):
+        key = self.handle.pop(f'job-{job}')
+        if key is not None:
+            self.handle.delete(self._job_key(key))
+        self.handle.delete(self._waiters_key(job))
+
+    def _slot(self):
+        """Wait for a free worker slot, held until the file is closed.
+
+        The slots are locked files, so the slot of a killed job is
+        released by the system.
+        """
+        paths = [os.path.join(self.directory, f'worker-{i}.lock')
+                 for i in range(self.workers)]
+        while True:
+            for path in paths:
+                slot = open(path, 'w')
+                try:
+                    fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return slot
+                except BlockingIOError:
+                    slot.close()
+            time.sleep(0.05)
+
+    def make_job_fn(self, fn, progress):
+        # The callbacks report their progress through `report` instead of
+        # taking a `set_progress` argument.
+        run = super().make_job_fn(fn, False)
+
+        def job_fn(result_key, progress_key, user_callback_args):
+            global _report
+
+            def set_progress(message):
+                self.handle.set(progress_key, [message])
+
+            _report = set_progress
+            report('Waiting for a free worker')
+            with self._slot():
+                report('Started')
+                run(result_key, progress_key, user_callback_args)
+            self._forget(os.getpid())
+
+        return job_fn
+
+    def call_job_fn(self, key, job_fn, args, context):
+        if self.result_ready(key):
+            # Computed for an identical request, no job needed.
+            return 0
+        job = self.handle.get(self._job_key(key))
+        if job is not None and self.job_running(job):
+            self.handle.incr(self._waiters_key(job))
+            return job
+        if isinstance(context.args_grouping, list):
+            # Dash 2.6 passes the inputs before the states; the callbacks
+            # take them in the order they were declared in.
+            args = [item.get('value') for item in context.args_grouping]
+        job = super().call_job_fn(key, job_fn, args, context)
+        self.handle.set(self._job_key(key), job, expire=self.expire)
+        self.handle.set(f'job-{job}', key, expire=self.expire)
+        self.handle.set(self._waiters_key(job), 1, expire=self.expire)
+        return job
+
+    def job_running(self, job):
+        return bool(job) and int(job) > 0 and super().job_running(job)
+
+    def terminate_job(self, job):
+        if not job or int(job) <= 0:
+            return
+        # Called when a request gets the result or moves on to new inputs.
+        if self.handle.decr(self._waiters_key(job), default=1) > 0:
+            return
+        self._forget(job)
+        super().terminate_job(job)
@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+
+from grid_index import KDTree
+
+match_columns = ['Teff', 'log_g', 'L', 'radius']
+match_count = int(os.environ.get('SDB_GRID_MATCH_COUNT', 10))
+
+
+def parse_target(target, columns=match_columns):
+    """Split `{column: (value, error)}` into arrays over `columns`.
+
+    Columns without a value or with a non-positive error are skipped.
+    """
+    values = np.full(len(columns), np.nan)
+    errors = np.full(len(columns), np.nan)
+    for i, name in enumerate(columns):
+        value, error = target.get(name, (None, None))
+        if value is not None and error is not None:
+            values[i], errors[i] = value, error
+    used = np.isfinite(values) & np.isfinite(errors) & (errors > 0)
+    if not used.any():
+        raise ValueError('target needs a value and an error for at '
+                         f'least one of {", ".join(columns)}')
+    return values, errors, used
+
+
+class TargetMatcher:
+    """Chi-square matching of observed targets against the grid models.
+
+    The models are indexed by a k-d tree over `match_columns`, each scaled
+    by its spread. A target with errors `e` defines the ellipsoid
+    `chi2 <= r**2`, which lies inside the box of half-widths `r * e`, so
+    a box query followed by the exact chi-square of the candidates gives
+    every model within `r` sigma.
+    """
+
+    def __init__(self, df, columns=None):
+        self.columns = list(columns or match_columns)
+        self.values = np.column_stack(
+            [df[name].to_numpy(dtype=float) for name in self.columns])
+        scale = np.nanstd(self.values, axis=0)
+        self.scale = np.where(np.isfinite(scale) & (scale > 0), scale, 1.0)
+        self.tree = KDTree(self.values / self.scale)
+
+    def _parse(self, target):
+        return parse_target(target, self.columns)
+
+    def chi2(self, rows, values, errors, used):
+        residuals = ((self.values[np.ix_(rows, used)] - values[used])
+                     / errors[used])
+        return np.einsum('ij,ij->i', residuals, residuals)
+
+    def _box(self, values, errors, used, radius):
+        low = np.where(used, (values - radius * errors) / self.scale, -np.inf)
+        high = np.where(used, (values + radius * errors) / self.scale, np.inf)
+        return low, high
+
+    def _ranked(self, rows, values, errors, used, radius=np.inf):
+        chi2 = self.chi2(rows, values, errors, used)
+        rows, chi2 = rows[chi2 <= radius ** 2], chi2[chi2 <= radius ** 2]
+        order = np.argsort(chi2, kind='stable')
+        return rows[order], chi2[order]
+
+    def within(self, target, sigma):
+        """Return the rows and chi-square of the models within `sigma`.
+
+        The rows are sorted by increasing chi-square.
+        """
+        values, errors, used = self._parse(target)
+        rows = self.tree.query(*self._box(values, errors, used, sigma))
+        return self._ranked(rows, values, errors, used, sigma)
+
+    def nearest(self, target, k=match_count):
+        """Return the rows and chi-square of the `k` best matching models.
+
+        The search radius doubles from one sigma until the ellipsoid holds
+        `k` models, which are then the exact best matches.
+        """
+        values, errors, used = self._parse(target)
+        radius = 1.0
+        while True:
+            low, high = self._box(values, errors, used, radius)
+            if self.tree.covers(low, high):
+                rows, chi2 = self._ranked(np.sort(self.tree.rows),
+                                          values, errors, used)
+                return rows[:k], chi2[:k]
+            rows, chi2 = self._ranked(self.tree.query(low, high),
+                                      values, errors, used, radius)
+            if len(rows) >= k:
+                return rows[:k], chi2[:k]
+            radius *= 2.0
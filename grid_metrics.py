@@ -0,0 +1,191 @@
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import flask
+
+logger = logging.getLogger(__name__)
+
+slow_callback = float(os.environ.get('SDB_GRID_SLOW_CALLBACK', 0)) or None
+
+time_buckets = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                1.0, 2.5, 5.0, 10.0]
+count_buckets = [1, 10, 100, 1_000, 10_000, 100_000, 1_000_000]
+byte_buckets = [2 ** 10 * 4 ** i for i in range(10)]
+
+_current = threading.local()
+
+
+class Histogram:
+    """Cumulative histogram in the Prometheus sense, one per label set."""
+
+    def __init__(self, name, description, buckets, labels):
+        self.name = name
+        self.description = description
+        self.buckets = list(buckets)
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            counts, total = self._series.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._series[key] = (counts, total + value)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}',
+                 f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted(self._series.items())
+        for key, (counts, total) in series:
+            labels = ','.join(f'{name}="{value}"'
+                              for name, value in zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ['+Inf'], counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} '
+                             f'{cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return '\n'.join(lines)
+
+
+phase_seconds = Histogram(
+    'sdb_callback_phase_seconds',
+    'Time spent in each phase of a callback request.',
+    time_buckets, ['callback', 'phase'])
+selected_rows = Histogram(
+    'sdb_callback_rows', 'Models selected by a callback.',
+    count_buckets, ['callback'])
+figure_traces = Histogram(
+    'sdb_callback_traces', 'Traces in the figures returned by a callback.',
+    count_buckets, ['callback'])
+response_bytes = Histogram(
+    'sdb_callback_response_bytes', 'Size of a callback response.',
+    byte_buckets, ['callback'])
+histograms = [phase_seconds, selected_rows, figure_traces, response_bytes]
+
+
+@contextmanager
+def phase(name):
+    """Time a phase of the running callback; usable as a decorator.
+
+    Outside of an instrumented callback it does nothing.
+    """
+    record = getattr(_current, 'record', None)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if record is not None:
+            record['phases'][name] = (record['phases'].get(name, 0.0)
+                                      + time.perf_counter() - start)
+
+
+def note(**values):
+    """Attach values such as `rows` to the running callback."""
+    record = getattr(_current, 'record', None)
+    if record is not None:
+        record.update(values)
+
+
+def _count_traces(output):
+    outputs = output if isinstance(output, (list, tuple)) else [output]
+    # Figures, or figure dicts such as those with typed arrays.
+    traces = [len(value['data'] if isinstance(value, dict) else value.data)
+              for value in outputs
+              if hasattr(value, 'data')
+              or (isinstance(value, dict) and 'data' in value)]
+    return sum(traces) if traces else None
+
+
+def timed(func):
+    """Record the phases, row and trace counts of a callback."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        record = {'callback': func.__name__, 'phases': {}}
+        _current.record = record
+        start = time.perf_counter()
+        try:
+            output = func(*args, **kwargs)
+            record['traces'] = _count_traces(output)
+            return output
+        finally:
+            record['phases']['callback'] = time.perf_counter() - start
+            _current.record = None
+            if flask.has_request_context():
+                flask.g.callback_record = record
+            else:
+                _observe(record)
+    return wrapper
+
+
+def _observe(record):
+    callback = record['callback']
+    for name, seconds in record['phases'].items():
+        phase_seconds.observe(seconds, callback=callback, phase=name)
+    if record.get('rows') is not None:
+        selected_rows.observe(record['rows'], callback=callback)
+    if record.get('traces') is not None:
+        figure_traces.observe(record['traces'], callback=callback)
+    if record.get('bytes') is not None:
+        response_bytes.observe(record['bytes'], callback=callback)
+
+
+def _start_request():
+    flask.g.request_start = time.perf_counter()
+
+
+def _finish_request(response):
+    record = flask.g.pop('callback_record', None)
+    if record is None:
+        return response
+    total = time.perf_counter() - flask.g.request_start
+    phases = record['phases']
+    phases['total'] = total
+    phases['serialize'] = max(total - phases['callback'], 0.0)
+    record['bytes'] = response.calculate_content_length()
+    _observe(record)
+    if slow_callback is not None and total >= slow_callback:
+        body = flask.request.get_json(silent=True) or {}
+        logger.warning(
+            'Slow callback %s: %.3f s, phases %s, rows %s, %s bytes, '
+            'inputs %s, state %s', record['callback'], total,
+            {name: round(seconds, 4) for name, seconds in phases.items()},
+            record.get('rows'), record['bytes'], body.get('inputs'),
+            body.get('state'))
+    return response
+
+
+def render():
+    return '\n'.join(histogram.render() for histogram in histograms) + '\n'
+
+
+def instrument(app):
+    """Time every callback registered on `app` from now on.
+
+    The aggregated histograms are served as Prometheus text at `/metrics`
+    of the Flask server.
+    """
+    register = app.callback
+
+    @functools.wraps(register)
+    def callback(*args, **kwargs):
+        decorator = register(*args, **kwargs)
+        return lambda func: decorator(timed(func))
+
+    app.callback = callback
+    app.server.before_request(_start_request)
+    app.server.after_request(_finish_request)
+    app.server.add_url_rule(
+        '/metrics', 'metrics',
+        lambda: flask.Response(render(),
+                               mimetype='text/plain; version=0.0.4'))
+    return app
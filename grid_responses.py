@@ -0,0 +1,194 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+
+import brotli
+import flask
+
+from grid_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+cache_mb = int(os.environ.get('SDB_GRID_FIGURE_CACHE_MB', 64))
+
+# In the order of preference.
+encodings = ['br', 'gzip']
+_compress = {
+    'br': lambda data: brotli.compress(data, quality=6),
+    'gzip': lambda data: gzip.compress(data, compresslevel=6),
+}
+_decompress = {'br': brotli.decompress, 'gzip': gzip.decompress}
+
+# Set in the WSGI environment of the warm-up requests.
+_warm_up_key = 'sdb_grid.warm_up'
+
+
+def is_warm_up():
+    """Return whether the current request warms the figure cache.
+
+    Warm-up requests can run in the master process before the workers are
+    forked, so they must not start anything meant to run per worker.
+    """
+    return bool(flask.request.environ.get(_warm_up_key))
+
+
+def _normalized(value):
+    # The browser sends 1.0 back as 1.
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, list):
+        return [_normalized(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _normalized(item) for key, item in value.items()}
+    return value
+
+
+def _values(items):
+    return [[item['id'], item['property'], _normalized(item.get('value'))]
+            for item in items or []]
+
+
+def request_key(payload, version):
+    """Return the content hash of a callback request of a grid version.
+
+    Requests that differ only in the representation of their values, or
+    in the order of their triggers, have the same hash.
+    """
+    normalized = {
+        'output': payload['output'],
+        'inputs': _values(payload.get('inputs')),
+        'state': _values(payload.get('state')),
+        'changed': sorted(payload.get('changedPropIds') or []),
+        'version': version,
+    }
+    return hashlib.sha256(json.dumps(
+        normalized, sort_keys=True, separators=(',', ':')).encode()
+    ).hexdigest()
+
+
+def _accepted(accept_encoding):
+    accepted = {part.split(';')[0].strip().lower()
+                for part in accept_encoding.split(',')}
+    return next((encoding for encoding in encodings
+                 if encoding in accepted), None)
+
+
+def _outputs(output):
+    def spec(name):
+        component_id, prop = name.rsplit('.', 1)
+        return {'id': component_id, 'property': prop}
+
+    if output.startswith('..'):
+        return [spec(name) for name in output[2:-2].split('...')]
+    return spec(output)
+
+
+class ResponseCache:
+    """Compressed responses of figure callbacks, keyed by their inputs.
+
+    The first response to a request is compressed and stored; identical
+    requests of the same grid version are then answered with the stored
+    bytes before the callback runs. Entries are evicted least recently
+    used first when their total size exceeds `maxbytes`.
+    """
+
+    def __init__(self, app, outputs, version, maxbytes=cache_mb * 2 ** 20):
+        self.app = app
+        self.outputs = set(outputs)
+        self.version = version
+        self.cache = LRUCache(
+            maxsize=4096, maxbytes=maxbytes,
+            sizeof=lambda entry: sum(map(len, entry.values())))
+
+    def install(self):
+        """Serve and store the responses of the cached callbacks.
+
+        Install after `Compress`, so the cached responses are not
+        compressed a second time.
+        """
+        server = self.app.server
+        server.before_request(self._lookup)
+        server.after_request(self._store)
+
+    def _lookup(self):
+        request = flask.request
+        if request.method != 'POST' \
+                or not request.path.endswith('_dash-update-component'):
+            return None
+        payload = request.get_json(silent=True) or {}
+        encoding = _accepted(request.headers.get('Accept-Encoding', ''))
+        if payload.get('output') not in self.outputs or encoding is None:
+            return None
+        key = request_key(payload, self.version())
+        entry = self.cache.get(key)
+        if entry is None:
+            flask.g.response_key = key, encoding
+            return None
+        if encoding not in entry:
+            # Stored for a client accepting another encoding.
+            stored, body = next(iter(entry.items()))
+            entry = dict(entry, **{
+                encoding: _compress[encoding](_decompress[stored](body))})
+            self.cache.put(key, entry)
+        return self._response(key, encoding, entry[encoding])
+
+    @staticmethod
+    def _response(key, encoding, body):
+        response = flask.Response(body, mimetype='application/json')
+        response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.set_etag(f'{key}-{encoding}')
+        return response
+
+    def _store(self, response):
+        key = flask.g.pop('response_key', None)
+        if key is None or response.status_code != 200 \
+                or 'Content-Encoding' in response.headers:
+            return response
+        key, encoding = key
+        body = _compress[encoding](response.get_data())
+        self.cache.put(key, {encoding: body})
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.set_etag(f'{key}-{encoding}')
+        return response
+
+    def warm(self, layout):
+        """Store the responses to the first requests of a new page.
+
+        The inputs are the initial values of the components of `layout`.
+        """
+        start = time.perf_counter()
+        components = {getattr(component, 'id', None): component
+                      for component in layout._traverse()}
+
+        def values(items):
+            return [{'id': item['id'], 'property': item['property'],
+                     'value': getattr(components.get(item['id']),
+                                      item['property'], None)}
+                    for item in items]
+
+        client = self.app.server.test_client()
+        path = self.app.get_relative_path('/_dash-update-component')
+        warmed = 0
+        for output in sorted(self.outputs & set(self.app.callback_map)):
+            callback = self.app.callback_map[output]
+            response = client.post(
+                path, headers={'Accept-Encoding': encodings[0]},
+                environ_base={_warm_up_key: True},
+                json={'output': output, 'outputs': _outputs(output),
+                      'inputs': values(callback['inputs']),
+                      'state': values(callback['state']),
+                      'changedPropIds': []})
+            if response.status_code == 200:
+                warmed += 1
+            else:
+                logger.warning('Warming %s failed with status %d', output,
+                               response.status_code)
+        logger.info('Warmed %d responses in %.1f s, %.1f MB cached',
+                    warmed, time.perf_counter() - start,
+                    self.cache.nbytes / 2 ** 20)
@@ -0,0 +1,268 @@
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
+
+from grid_cache import LRUCache
+from grid_cube import SummaryCube, summary_columns
+from grid_data import cols_to_remove, database, model_record
+from grid_index import grid_parameters
+from grid_match import match_columns, match_count, parse_target
+
+logger = logging.getLogger(__name__)
+
+pool_size = int(os.environ.get('SDB_GRID_SQL_POOL', 4))
+cache_mb = int(os.environ.get('SDB_GRID_SQL_CACHE_MB', 256))
+
+# Viewer columns stored under another name, or as their base-10 logarithm.
+renamed = {'y_c': 'custom_profile'}
+logarithmic = {'Teff': 'log_Teff', 'L': 'log_L'}
+
+indexes = {
+    # Covers the slider filter together with the predefined plots.
+    'models_grid': ['z_i', 'm_i', 'm_env', 'custom_profile', 'log_Teff',
+                    'log_g', 'log_L', 'radius', 'id'],
+    # Covers the target matches and the Teff viewport queries.
+    'models_observables': ['log_Teff', 'log_g', 'log_L', 'radius', 'id'],
+    # The lookup of single models, e.g. hovered ones.
+    'models_id': ['id'],
+}
+
+# Multiplicative hash of the id, a fixed pseudo-random sampling order.
+_priority = '("id" * 2654435761) % 4294967296'
+
+
+def create_indexes(database=database):
+    """Create the covering indexes of the out-of-core mode, if missing.
+
+    The statistics of the query planner are only updated when an index
+    was created, so an indexed database is not modified. Returns False
+    when the database cannot be written.
+    """
+    engine = create_engine(f'sqlite:///{database}')
+    try:
+        with engine.begin() as connection:
+            existing = set(connection.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'index'")
+            ).scalars())
+            missing = {name: index_columns
+                       for name, index_columns in indexes.items()
+                       if name not in existing}
+            for name, index_columns in missing.items():
+                connection.execute(text(
+                    f'CREATE INDEX "{name}" ON models ('
+                    + ', '.join(f'"{column}"' for column in index_columns)
+                    + ')'))
+            if missing:
+                connection.execute(text('ANALYZE'))
+    except OperationalError as e:
+        logger.warning('Cannot create the indexes of %s: %s', database, e)
+        return False
+    finally:
+        engine.dispose()
+    return True
+
+
+def _source(name):
+    return logarithmic.get(name, renamed.get(name, name))
+
+
+def _frame_size(frame):
+    return int(frame.memory_usage(index=False, deep=True).sum())
+
+
+class SqliteGrid:
+    """The `models` table queried in place, without loading it into memory.
+
+    Slider ranges, viewport boxes and target boxes become `WHERE` clauses
+    over the indexed columns and only the requested columns are read. The
+    results are kept in an LRU cache bounded by their size, and the
+    read-only connections come from a pool shared by all callbacks.
+    """
+
+    def __init__(self, database=database, pool_size=pool_size,
+                 maxbytes=cache_mb * 2 ** 20):
+        self.engine = create_engine(
+            f'sqlite:///file:{database}?mode=ro&uri=true',
+            poolclass=QueuePool, pool_size=pool_size, max_overflow=0,
+            connect_args={'check_same_thread': False})
+        names = [column['name']
+                 for column in inspect(self.engine).get_columns('models')
+                 if column['name'] not in cols_to_remove]
+        sources = {source: name for name, source in renamed.items()}
+        self.columns = [sources.get(name, name) for name in names] \
+            + list(logarithmic)
+        self.cache = LRUCache(maxsize=256, maxbytes=maxbytes,
+                              sizeof=_frame_size)
+        self.version = -1
+        self.refresh()
+        # Connections must not be inherited by forked workers.
+        self.engine.dispose()
+
+    def refresh(self):
+        """Forget the cached results after the database has changed.
+
+        The cache keys include the version, so results of queries still
+        running are not served afterwards. The summary cube is aggregated
+        again from all the models, streamed in chunks.
+        """
+        bounds = self.query('SELECT {} FROM models'.format(', '.join(
+            f'min("{_source(name)}"), max("{_source(name)}")'
+            for name in match_columns)), {}).iloc[0].to_numpy(dtype=float)
+        self.bounds = {name: self._converted(name, bounds[2 * i:2 * i + 2])
+                       for i, name in enumerate(match_columns)}
+        self.summary = SummaryCube(
+            self.chunks(grid_parameters + summary_columns))
+        self.cache.clear()
+        self.version += 1
+
+    def __len__(self):
+        return int(self.query('SELECT count(*) FROM models', {}).iat[0, 0])
+
+    @staticmethod
+    def _converted(name, values):
+        return 10.0 ** values if name in logarithmic else values
+
+    def query(self, sql, params):
+        with self.engine.connect() as connection:
+            return pd.read_sql(text(sql), connection, params=params)
+
+    def _where(self, ranges=None, box=None, ids=None):
+        """Return the `WHERE` clause and parameters of a selection.
+
+        `ranges` and `box` map viewer columns to `(low, high)` bounds,
+        `ids` restricts the selection to the given model ids.
+        """
+        conditions, params = [], {}
+        items = list((ranges or {}).items()) + list((box or {}).items())
+        for i, (name, (low, high)) in enumerate(items):
+            source = _source(name)
+            if name in logarithmic:
+                if high <= 0:
+                    return 'WHERE 0', {}
+                low = np.log10(low) if low > 0 else -np.inf
+                high = np.log10(high)
+            if np.isfinite(low):
+                conditions.append(f'"{source}" >= :low{i}')
+                params[f'low{i}'] = float(low)
+            if np.isfinite(high):
+                conditions.append(f'"{source}" <= :high{i}')
+                params[f'high{i}'] = float(high)
+        if ids is not None:
+            conditions.append('"id" IN (SELECT value FROM json_each(:ids))')
+            params['ids'] = json.dumps(np.asarray(ids).tolist())
+        if not conditions:
+            return '', params
+        return 'WHERE ' + ' AND '.join(conditions), params
+
+    def _select(self, columns, where, limit=None):
+        sql = 'SELECT {} FROM models {}'.format(', '.join(
+            f'"{_source(name)}" AS "{name}"' for name in columns), where)
+        if limit is not None:
+            sql += f' ORDER BY {_priority} LIMIT {int(limit)}'
+        return sql
+
+    def _convert(self, frame):
+        for name in logarithmic:
+            if name in frame.columns:
+                frame[name] = 10.0 ** frame[name]
+        return frame
+
+    def frame(self, columns, ranges=None, box=None, ids=None, limit=None):
+        """Return the `columns` of the selected models.
+
+        With `limit`, at most that many models are returned, always the
+        same ones for the same selection, so zooming in only adds points.
+        """
+        columns = list(dict.fromkeys(columns))
+        where, params = self._where(ranges, box, ids)
+        sql = self._select(columns, where, limit)
+        return self.cache.get_or_compute(
+            (self.version, sql, tuple(sorted(params.items()))),
+            lambda: self._convert(self.query(sql, params)))
+
+    def count(self, ranges=None, box=None):
+        where, params = self._where(ranges, box)
+        sql = f'SELECT count(*) FROM models {where}'
+        return int(self.cache.get_or_compute(
+            (self.version, sql, tuple(sorted(params.items()))),
+            lambda: self.query(sql, params)).iat[0, 0])
+
+    def chunks(self, columns, ranges=None, ids=None, chunk_size=50_000):
+        """Yield the `columns` of the selected models in chunks of rows.
+
+        The rows are streamed from the database and are not cached. An
+        empty selection still yields one empty chunk.
+        """
+        where, params = self._where(ranges, ids=ids)
+        sql = self._select(columns, where)
+        empty = True
+        with self.engine.connect() as connection:
+            for chunk in pd.read_sql(text(sql), connection, params=params,
+                                     chunksize=chunk_size):
+                empty = False
+                yield self._convert(chunk)
+        if empty:
+            yield pd.DataFrame(columns=columns)
+
+    def models(self, ids, columns):
+        """Return the `columns` of the models with `ids`, in that order."""
+        frame = self.frame(['id'] + list(columns), ids=ids)
+        order = pd.Index(frame['id']).get_indexer(np.asarray(ids))
+        return frame.iloc[order[order >= 0]].reset_index(drop=True)
+
+    def row(self, model_id):
+        """Return the model with `model_id` as a dict, or None.
+
+        Single models are not cached, so hovering over many models does
+        not evict the plotted selections.
+        """
+        frame = self._convert(self.query(
+            self._select(self.columns, 'WHERE "id" = :id'),
+            {'id': int(model_id)}))
+        return model_record(frame) if len(frame) else None
+
+    def _box(self, values, errors, used, radius):
+        return {name: (value - radius * error, value + radius * error)
+                for name, value, error, use
+                in zip(match_columns, values, errors, used) if use}
+
+    def _ranked(self, box, values, errors, used, radius=np.inf):
+        candidates = self.frame(['id'] + match_columns, box=box)
+        residuals = ((candidates[match_columns].to_numpy(dtype=float)[:, used]
+                      - values[used]) / errors[used])
+        chi2 = np.einsum('ij,ij->i', residuals, residuals)
+        inside = chi2 <= radius ** 2
+        ids, chi2 = candidates['id'].to_numpy()[inside], chi2[inside]
+        order = np.argsort(chi2, kind='stable')
+        return ids[order], chi2[order]
+
+    def within(self, target, sigma):
+        """Return the ids and chi-square of the models within `sigma`.
+
+        Like `TargetMatcher.within`, with the box query done by SQLite.
+        """
+        values, errors, used = parse_target(target)
+        return self._ranked(self._box(values, errors, used, sigma),
+                            values, errors, used, sigma)
+
+    def nearest(self, target, k=match_count):
+        """Return the ids and chi-square of the `k` best matching models."""
+        values, errors, used = parse_target(target)
+        radius = 1.0
+        while True:
+            box = self._box(values, errors, used, radius)
+            if all(low <= self.bounds[name][0]
+                   and high >= self.bounds[name][1]
+                   for name, (low, high) in box.items()):
+                ids, chi2 = self._ranked({}, values, errors, used)
+                return ids[:k], chi2[:k]
+            ids, chi2 = self._ranked(box, values, errors, used, radius)
+            if len(ids) >= k:
+                return ids[:k], chi2[:k]
+            radius *= 2.0
@@ -0,0 +1,112 @@
+import argparse
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+from grid_data import database
+
+logger = logging.getLogger(__name__)
+
+
+def grid_axes(m_i_step=0.005):
+    """Return the values of the grid parameters, spaced as in the real grid.
+
+    `m_i_step` (a multiple of 0.005) thins the initial masses to make
+    smaller grids of the same shape.
+    """
+    return {
+        'z_i': np.round(np.arange(0.005, 0.0351, 0.005), 3),
+        'm_i': np.round(np.arange(1.0, 1.8 + m_i_step / 2, m_i_step), 3),
+        'm_env': np.round(np.concatenate([np.arange(1, 31) * 0.0001,
+                                          np.arange(4, 11) * 0.001]), 4),
+        'y_c': np.round(np.arange(0.9, 0.09, -0.05), 2),
+    }
+
+
+def synthetic_models(m_i_step=0.005, seed=0):
+    """Make a `models` table with the schema of the real grid.
+
+    The physical columns follow smooth, roughly sdB-like relations with
+    some noise; they are meant for exercising the viewer, not for science.
+    """
+    rng = np.random.default_rng(seed)
+    axes = grid_axes(m_i_step)
+    z_i, m_i, m_env, y_c = (values.ravel() for values in np.meshgrid(
+        axes['z_i'], axes['m_i'], axes['m_env'], axes['y_c'],
+        indexing='ij'))
+    n = len(z_i)
+    m_he_core = 0.47 - 0.02 * (m_i - 1.0) + rng.normal(0.0, 0.002, n)
+    radius = (0.15 + 15.0 * m_env + 0.05 * (0.9 - y_c)
+              + 0.5 * z_i) * rng.normal(1.0, 0.01, n)
+    log_l = (1.2 + 0.3 * (0.9 - y_c) + 20.0 * m_env - 4.0 * z_i
+             + rng.normal(0.0, 0.01, n))
+    log_teff = np.log10(5772.0) + 0.25 * (log_l - 2.0 * np.log10(radius))
+    models = {
+        'id': np.arange(1, n + 1),
+        'm_i': m_i,
+        'm_env': m_env,
+        'z_i': z_i,
+        'y_i': 0.24 + 1.5 * z_i,
+        'm_he_core': m_he_core,
+        'log_g': (4.438 + np.log10(m_he_core + m_env)
+                  - 2.0 * np.log10(radius)),
+        'radius': radius,
+        'age': 1.0e10 * m_i ** -2.5 + 1.0e8 * (0.9 - y_c),
+        'z_surf': z_i * rng.uniform(0.9, 1.0, n),
+        'y_surf': rng.uniform(0.001, 0.05, n),
+        'center_he4': np.clip(y_c + rng.normal(0.0, 0.002, n), 0.0, 1.0),
+        'custom_profile': y_c,
+        'log_Teff': log_teff,
+        'log_L': log_l,
+        'rot_i': np.zeros(n),
+        'rot': np.zeros(n),
+        'fh': np.zeros(n),
+        'fhe': np.zeros(n),
+        'fsh': np.zeros(n),
+        'mlt': np.full(n, 1.8),
+        'sc': np.full(n, 0.1),
+        'reimers': np.zeros(n),
+        'blocker': np.zeros(n),
+        'turbulence': np.zeros(n),
+        'model_number': rng.integers(1000, 20000, n),
+        'level': np.ones(n, dtype=int),
+    }
+    df = pd.DataFrame(models)
+    df['top_dir'] = [f'logs_mi{m:.3f}_z{z:.3f}' for m, z in zip(m_i, z_i)]
+    df['log_dir'] = [f'menv{m:.4f}' for m in m_env]
+    return df
+
+
+def write_database(df, path, force=False):
+    if os.path.exists(path):
+        if not force:
+            raise FileExistsError(f'{path} exists, use force to replace it')
+        os.remove(path)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    engine = create_engine(f'sqlite:///{path}')
+    df.to_sql('models', engine, index=False, chunksize=50_000)
+    engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic sdB grid database.')
+    parser.add_argument('--database', default=database)
+    parser.add_argument('--m-i-step', type=float, default=0.005,
+                        help='step of the initial masses')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--force', action='store_true',
+                        help='replace an existing database')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    df = synthetic_models(args.m_i_step, args.seed)
+    write_database(df, args.database, args.force)
+    logger.info('Wrote %d synthetic models to %s', len(df), args.database)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,42 @@
+import base64
+import importlib.util
+import io
+import logging
+import os
 from pathlib import Path
+from urllib.parse import urlencode
 
 import dash
 import dash_bootstrap_components as dbc
+import flask
 import numpy as np
 import pandas as pd
-import plotly.express as px
-from dash import dcc, html, Input, Output, State
-from sqlalchemy import create_engine
+import plotly.graph_objects as go
+from dash import (ClientsideFunction, dash_table, dcc, html, Input, Output,
+                  State)
+from dash.exceptions import PreventUpdate
+from flask_compress import Compress
+
+from grid_cache import LRUCache
+from grid_client import build_client_grid
+from grid_cube import interpolated_columns, summary_columns
+from grid_data import (DatabaseWatcher, database, float32_values,
+                       load_models, read_models, reload_interval)
+from grid_dataset import GridDataset
+from grid_derived import functions
+from grid_export import (export_chunks, export_formats, frame_chunks,
+                         parse_range)
+from grid_fit import fit_targets, read_targets, result_columns
+from grid_figures import (encoded_arrays, figure_response, hover_label,
+                          lazy_hover, max_points, models_figure,
+                          scatter_figure, summary_figure, track_trace,
+                          track_values, typed_arrays)
+from grid_index import SpatialIndex, decimate, grid_parameters
+from grid_jobs import GridJobManager, background_jobs, report
+from grid_match import match_columns
+from grid_metrics import instrument, note, phase
+from grid_responses import ResponseCache, cache_mb, is_warm_up
+from grid_sql import SqliteGrid, create_indexes
 
 SIDEBAR_STYLE = {
     'overflow': 'scroll'
@@ -18,22 +48,138 @@ app = dash.Dash(__name__,
                 meta_tags=[{'name': 'viewport',
                             'content': 'width=device-width, initial-scale=1.0'}])
 
+instrument(app)
 server = app.server
+if typed_arrays:
+    # Decode the typed arrays of every callback response before Dash
+    # passes it to the components, see assets/typed_arrays.js.
+    app.renderer = ('var renderer = new DashRenderer({request_post: '
+                    'function (payload, response) {'
+                    'window.dash_clientside.arrays.decode(response);}});')
+Compress(server)
+
+logging.basicConfig(level=logging.INFO)
+# With SDB_GRID_BACKEND=sqlite the models are queried from the database
+# instead of being loaded; the features needing the whole grid are off.
+out_of_core = os.environ.get('SDB_GRID_BACKEND', 'memory') == 'sqlite'
+if out_of_core:
+    create_indexes(database)
+    sql_grid = SqliteGrid(database)
+    columns = sql_grid.columns
+else:
+    dataset = GridDataset(load_models())
+    columns = list(dataset.df.columns)
+# The cache keys start with the grid version, so entries of replaced
+# versions are never served and age out.
+spatial_indexes = LRUCache(maxsize=8)
+selection_cache = LRUCache(
+    maxsize=int(os.environ.get('SDB_GRID_SELECTION_CACHE', 64)),
+    maxbytes=int(os.environ.get('SDB_GRID_SELECTION_CACHE_MB', 32)) * 2 ** 20)
+match_cache = LRUCache(maxsize=64)
+
+
+def current():
+    """Return the grid version of the current request.
+
+    The version is fixed at its first use in a request, so a callback
+    running during a reload finishes with the models it started with.
+    """
+    if not flask.has_request_context():
+        return dataset
+    if 'dataset' not in flask.g:
+        flask.g.dataset = dataset
+    return flask.g.dataset
+
+
+def reload_models():
+    """Add the models appended to the database since the last load.
+
+    Models are recognised as new by their id, so changes to existing
+    models need a restart. The new version replaces the current one in a
+    single assignment.
+    """
+    global dataset
+    if out_of_core:
+        sql_grid.refresh()
+        if cache_responses:
+            response_cache.warm(layout())
+        return
+    new = read_models(database, after_id=dataset.max_id)
+    if len(new):
+        dataset = dataset.extended(new)
+        if cache_responses:
+            response_cache.warm(layout())
+
+
+if reload_interval > 0 and os.path.exists(database):
+    watcher = DatabaseWatcher(reload_models)
+
+    @server.before_request
+    def start_watcher():
+        # Started by the first request of every worker process.
+        if not is_warm_up():
+            watcher.start()
+
+client_side = (os.environ.get('SDB_GRID_CLIENT_SIDE', '0') == '1'
+               and not out_of_core)
+client_manifests = LRUCache(maxsize=2)
+client_payloads = LRUCache(maxsize=2)
+
+
+def client_grid(grid):
+    """Return the manifest of the client-side copy of a grid version."""
+    def build():
+        payload, manifest = build_client_grid(grid.df)
+        manifest['url'] = app.get_relative_path(
+            f'/client-grid/{manifest["hash"]}.bin')
+        client_payloads.put(manifest['hash'], payload)
+        return manifest
+
+    return client_manifests.get_or_compute(grid.version, build)
+
+
+if client_side:
+    client_grid(dataset)
+
+
+def grid_version():
+    """Return the version of the grid used by the current request."""
+    return sql_grid.version if out_of_core else current().version
 
-database = 'data/sdb_grid.db'
-engine = create_engine(f'sqlite:///{database}')
-df = pd.read_sql('models', engine)
-df['Teff'] = 10.0 ** df['log_Teff']
-df['L'] = 10.0 ** df['log_L']
-cols_to_remove = ['rot_i', 'rot', 'fh', 'fhe', 'fsh', 'mlt', 'sc', 'reimers',
-                  'blocker', 'turbulence', 'model_number', 'level',
-                  'log_Teff', 'log_L', 'top_dir', 'log_dir']
-df = df.drop(columns=cols_to_remove)
-df.rename(columns={'custom_profile': 'y_c'}, inplace=True)
-columns = list(df.columns)
+
+job_manager = GridJobManager(grid_version) if background_jobs else None
+
+
+def job_status(status_id):
+    """Return the line showing the progress of a background job."""
+    if not background_jobs:
+        return []
+    return [html.Div(id=status_id, className='text-muted')]
+
+
+def background(status_id):
+    """Return the arguments running a callback as a background job.
+
+    Without the background mode the callback runs within the request.
+    """
+    if not background_jobs:
+        return {}
+    return {'background': True, 'manager': job_manager, 'interval': 500,
+            'progress': [Output(status_id, 'children')],
+            'progress_default': ['']}
+
+
+color_options = [
+    {'label': 'z_i', 'value': 'z_i'},
+    {'label': 'm_i', 'value': 'm_i'},
+    {'label': 'm_env', 'value': 'm_env'},
+    {'label': 'center_he4', 'value': 'y_c'},
+]
 
 hover_data = ['Teff', 'log_g', 'z_i', 'm_i', 'm_env', 'y_c',
               'L', 'radius', 'age']
+match_table_columns = ['id', 'chi2', 'Teff', 'log_g', 'L', 'radius',
+                       'z_i', 'm_i', 'm_env', 'y_c']
 
 about_file = Path('assets/about.md')
 with about_file.open('r') as f:
@@ -44,12 +190,7 @@ controls = dbc.Container([
         dbc.Label('Select a color:'),
         dbc.Select(
             id='dropdown_colors',
-            options=[
-                {'label': 'z_i', 'value': 'z_i'},
-                {'label': 'm_i', 'value': 'm_i'},
-                {'label': 'm_env', 'value': 'm_env'},
-                {'label': 'center_he4', 'value': 'y_c'},
-            ],
+            options=color_options,
             value='z_i',
             persistence=True
         )]),
@@ -66,6 +207,14 @@ controls = dbc.Container([
             value='m_i',
             persistence=True
         )]),
+    dbc.Card([
+        dbc.Switch(
+            id='show_tracks',
+            label='Show tracks',
+            value=False,
+            disabled=out_of_core,
+            persistence=True
+        )]),
     html.Br(),
     dbc.Card([
         dbc.Label('Z_i'),
@@ -124,7 +273,7 @@ controls = dbc.Container([
         dbc.Label('Hover data'),
         dcc.Dropdown(
             id='dropdown_hover_data',
-            options=[{'label': x, 'value': x} for x in df.columns],
+            options=[{'label': x, 'value': x} for x in columns],
             value=hover_data,
             multi=True,
             persistence=True
@@ -268,6 +417,44 @@ controls = dbc.Container([
         className='d-grid gap-2',
     ),
     html.Br(),
+    dbc.Card([
+        dbc.Label('Target catalog (CSV)'),
+        dcc.Upload(
+            id='catalog_upload',
+            children=html.Div(['Drop or ', html.A('select a file')]),
+            style={'borderWidth': 1, 'borderStyle': 'dashed',
+                   'borderRadius': 5, 'padding': 10},
+            disabled=out_of_core,
+        ),
+        html.Div(id='catalog_status'),
+        *job_status('catalog_progress'),
+        dcc.Download(id='catalog_download'),
+    ]),
+    html.Br(),
+    dbc.Card([
+        dbc.Label('Export selection'),
+        dbc.RadioItems(
+            id='export_format',
+            options=[{'label': 'CSV', 'value': 'csv'},
+                     {'label': 'Parquet', 'value': 'parquet'}],
+            value='csv',
+            inline=True,
+            persistence=True
+        ),
+        dbc.Switch(
+            id='export_matches',
+            label='Only models matching the target',
+            value=False,
+            persistence=True
+        ),
+        html.A(
+            dbc.Button('Download', color='secondary'),
+            id='export_link',
+            href='',
+            className='d-grid gap-2',
+        ),
+    ]),
+    html.Br(),
     html.Br(),
     html.Br(),
 ],
@@ -284,20 +471,24 @@ sidebar = html.Div([
 )
 
 tab_logg_teff = dbc.Row([
-    dbc.Col(dcc.Graph(id='logg-teff', mathjax=True), md=12)
+    dbc.Col([dcc.Graph(id='logg-teff', mathjax=True),
+             *job_status('logg-teff-status')], md=12)
 ])
 
 tab_lum_teff = dbc.Row([
-    dbc.Col(dcc.Graph(id='L-teff', mathjax=True), md=12)
+    dbc.Col([dcc.Graph(id='L-teff', mathjax=True),
+             *job_status('L-teff-status')], md=12)
 ])
 
 tab_rad_teff = dbc.Row([
-    dbc.Col(dcc.Graph(id='R-teff', mathjax=True), md=12)
+    dbc.Col([dcc.Graph(id='R-teff', mathjax=True),
+             *job_status('R-teff-status')], md=12)
 ])
 
 tab_custom_plot = html.Div([
     dbc.Row([
-        dbc.Col(dcc.Graph(id='custom_plot', mathjax=True), md=12)
+        dbc.Col([dcc.Graph(id='custom_plot', mathjax=True),
+                 *job_status('custom_plot-status')], md=12)
     ]),
     dbc.Row([
         dbc.Col(
@@ -356,6 +547,124 @@ tab_custom_plot = html.Div([
             ]),
             md=4
         ),
+        dbc.Col(
+            dbc.Card([
+                dbc.Label('Derived column', className='text-center'),
+                dbc.InputGroup([
+                    dbc.Input(
+                        id='derived_expression',
+                        placeholder='e.g. log10(L) / radius**2',
+                        type='text',
+                    ),
+                    dbc.Button('Add', id='derived_add', n_clicks=0,
+                               disabled=out_of_core),
+                ]),
+                html.Div(id='derived_status'),
+            ]),
+            md=4
+        ),
+    ],
+        justify='center'),
+    dcc.Store(id='derived_columns', data=[], storage_type='local'),
+])
+
+tab_summary = html.Div([
+    dbc.Row([
+        dbc.Col(html.H5(id='summary_count', className='text-center mt-2'),
+                md=12)
+    ]),
+    dbc.Row([
+        dbc.Col(dcc.Graph(id='summary_plot', mathjax=True), md=12)
+    ]),
+    dbc.Row([
+        dbc.Col(
+            dbc.Card([
+                dbc.Label('Histogram', className='text-center'),
+                dbc.Select(
+                    id='summary_column',
+                    options=[{'label': name, 'value': name}
+                             for name in summary_columns],
+                    value='Teff',
+                    persistence=True,
+                ),
+            ]),
+            md=3
+        ),
+        dbc.Col(
+            dash_table.DataTable(
+                id='summary_table',
+                columns=[{'name': name, 'id': name} for name in
+                         ('column', 'count', 'mean', 'min', 'max')],
+                data=[],
+            ),
+            md=6
+        ),
+    ],
+        justify='center'),
+])
+
+interpolation_inputs = [
+    ('z_i', 'Z_i', 0.02),
+    ('m_i', 'M_i [Ms]', 1.2),
+    ('m_env', 'M_env [Ms]', 0.002),
+    ('y_c', 'Y_c', 0.5),
+]
+
+tab_interpolation = html.Div([
+    dbc.Row([
+        dbc.Col(dcc.Graph(id='interpolation_plot', mathjax=True), md=12)
+    ]),
+    dbc.Row([
+        dbc.Col(
+            dbc.Card([
+                dbc.Label('Grid parameters', className='text-center'),
+                *[dbc.InputGroup([
+                    dbc.InputGroupText(f'{label}:'),
+                    dbc.Input(
+                        id=f'interpolation_{name}',
+                        type='number',
+                        value=value,
+                        persistence=True
+                    ),
+                ]) for name, label, value in interpolation_inputs],
+                dbc.Label('Vary:'),
+                dbc.RadioItems(
+                    id='interpolation_vary',
+                    options=[{'label': label, 'value': name}
+                             for name, label, _ in interpolation_inputs],
+                    value='y_c',
+                    inline=True,
+                ),
+            ]),
+            md=4
+        ),
+        dbc.Col(
+            dbc.Card([
+                dbc.Label('Axes', className='text-center'),
+                dbc.Select(
+                    id='interpolation_x',
+                    options=[{'label': label, 'value': label} for label in
+                             interpolated_columns],
+                    value='Teff',
+                ),
+                dbc.Select(
+                    id='interpolation_y',
+                    options=[{'label': label, 'value': label} for label in
+                             interpolated_columns],
+                    value='log_g',
+                ),
+            ]),
+            md=3
+        ),
+        dbc.Col(
+            dash_table.DataTable(
+                id='interpolation_table',
+                columns=[{'name': 'column', 'id': 'column'},
+                         {'name': 'value', 'id': 'value'}],
+                data=[],
+            ),
+            md=3
+        ),
     ],
         justify='center'),
 ])
@@ -369,24 +678,601 @@ tabs = dbc.Tabs([
     dbc.Tab(tab_lum_teff, label='L vs. Teff'),
     dbc.Tab(tab_rad_teff, label='R vs. Teff'),
     dbc.Tab(tab_custom_plot, label='Custom plot'),
+    dbc.Tab(tab_summary, label='Summary'),
+    *([] if out_of_core
+      else [dbc.Tab(tab_interpolation, label='Interpolation')]),
     dbc.Tab(tab_about, label='About'),
 ])
 
-layout = html.Div([
-    dbc.Row([
-        dbc.Col(sidebar, width=3),
-        dbc.Col(tabs, width=True),
-    ]),
-])
+target_matches = dbc.Card([
+    dbc.Label('Target matches', className='text-center'),
+    html.Div(id='matches_summary', className='text-center'),
+    dash_table.DataTable(
+        id='matches_table',
+        columns=[{'name': name, 'id': name} for name in match_table_columns],
+        data=[],
+        sort_action='native',
+        style_table={'overflowX': 'auto'},
+    ),
+],
+    className='mt-2')
+
+model_details = dbc.Card([
+    dbc.Label('Model', className='text-center'),
+    html.Div('Hover over or click a model to show all its columns.',
+             id='model_summary', className='text-center'),
+    dash_table.DataTable(
+        id='model_table',
+        columns=[{'name': name, 'id': name} for name in columns],
+        data=[],
+        style_table={'overflowX': 'auto'},
+    ),
+],
+    className='mt-2')
+
+graph_ids = ['logg-teff', 'L-teff', 'R-teff', 'custom_plot']
+
+# Axes of the predefined plots, used by the client-side figures.
+views = [
+    {'graph': 'logg-teff', 'x': 'Teff', 'y': 'log_g',
+     'x_reverse': True, 'y_reverse': True},
+    {'graph': 'L-teff', 'x': 'Teff', 'y': 'L',
+     'x_reverse': True, 'y_reverse': False},
+    {'graph': 'R-teff', 'x': 'Teff', 'y': 'radius',
+     'x_reverse': True, 'y_reverse': False},
+]
+
+
+def layout():
+    # Built for every page load, so new pages get the current client grid.
+    client_stores = [
+        dcc.Store(id='client_grid', data=client_grid(current())),
+        dcc.Store(id='client_grid_ready'),
+        dcc.Interval(id='client_grid_poll', interval=250),
+        *[dcc.Store(id=f'{view["graph"]}-view', data=view)
+          for view in views],
+    ] if client_side else []
+    return html.Div([
+        dbc.Row([
+            dbc.Col(sidebar, width=3),
+            dbc.Col([tabs, target_matches,
+                     *([model_details] if lazy_hover else [])],
+                    width=True),
+        ]),
+        *[dcc.Store(id=f'{graph_id}-viewport') for graph_id in graph_ids],
+        dcc.Store(id='custom_plot-figure'),
+        dcc.Store(id='custom_plot-shown'),
+        dcc.Store(id='target'),
+        *client_stores,
+    ])
+
 
 app.layout = layout
 
 
+def plot_callback(*args, **kwargs):
+    """Register a callback of the predefined plots.
+
+    In the client-side mode these plots are drawn in the browser, so the
+    server callbacks are left out.
+    """
+    if client_side:
+        return lambda func: func
+    return app.callback(*args, **kwargs)
+
+
+def grid_callback(*args, **kwargs):
+    """Register a callback that needs the whole grid in memory.
+
+    These callbacks are left out in the out-of-core mode.
+    """
+    if out_of_core:
+        return lambda func: func
+    return app.callback(*args, **kwargs)
+
+
+def selection_key(z_i_range, m_i_range, m_env_range, y_c_range):
+    return tuple((round(min(values), 6), round(max(values), 6))
+                 for values in (z_i_range, m_i_range, m_env_range, y_c_range))
+
+
+def _select_rows(grid, key):
+    rows = grid.grid_index.select(dict(zip(grid_parameters, key)))
+    # Half the size of the default integers in the cache.
+    rows = rows.astype(np.int32 if len(grid) < 2 ** 31 else np.int64)
+    rows.flags.writeable = False
+    return rows
+
+
+@phase('filter')
+def select_rows(z_i_range, m_i_range, m_env_range, y_c_range):
+    report('Selecting the models')
+    grid = current()
+    key = selection_key(z_i_range, m_i_range, m_env_range, y_c_range)
+    rows = selection_cache.get_or_compute(
+        (grid.version, key), lambda: _select_rows(grid, key))
+    note(rows=len(rows))
+    return rows
+
+
+@phase('match')
+def match_target(target):
+    """Return the best matches and the models within the chosen sigma.
+
+    `None` means that no target was given.
+    """
+    if not target or not target['columns']:
+        return None
+    report('Matching the target')
+    if out_of_core:
+        matcher, version = sql_grid, sql_grid.version
+    else:
+        grid = current()
+        matcher, version = grid.matcher, grid.version
+    key = (version,
+           tuple(sorted((name, tuple(value_error)) for name, value_error
+                        in target['columns'].items())), target['sigma'])
+
+    def compute():
+        best = matcher.nearest(target['columns'])
+        inside = matcher.within(target['columns'], target['sigma'])
+        return {'best': best, 'inside': inside}
+
+    return match_cache.get_or_compute(key, compute)
+
+
+axis_functions = {2: 'log10', 3: 'exp10'}
+
+
+def plot_values(name, function=1):
+    """Return a column or derived column of every model, as plotted.
+
+    `function` is the axis transform of the custom plot. Derived and
+    transformed columns are evaluated once and memoized.
+    """
+    grid = current()
+    if function in axis_functions:
+        return grid.derived_columns.values(
+            f'{axis_functions[function]}({name})')
+    if name in grid.df.columns:
+        return grid.df[name].to_numpy(dtype=float)
+    return grid.derived_columns.values(name)
+
+
+def spatial_index(x, y, x_function=1, y_function=1):
+    def build():
+        return SpatialIndex(plot_values(x, x_function),
+                            plot_values(y, y_function))
+
+    return spatial_indexes.get_or_compute(
+        (current().version, x, x_function, y, y_function), build)
+
+
+@phase('figure')
+def plot_models(rows, x, y, colors_value, symbols_value, hover_data_value,
+                viewport=None, x_function=1, y_function=1, tracks=False):
+    grid = current()
+    if viewport:
+        rows = spatial_index(x, y, x_function, y_function).query(
+            viewport.get('xaxis'), viewport.get('yaxis'), rows)
+        shown = decimate(rows, max_points, grid.priority)
+    else:
+        shown = rows
+    report(f'Drawing {len(shown)} models')
+    dff = grid.df.iloc[shown]
+    plotted = {name: plot_values(name, function)[shown]
+               for name, function in ((colors_value, 1), (x, x_function),
+                                      (y, y_function))
+               if function != 1 or name not in grid.df.columns}
+    if plotted:
+        dff = dff.assign(**plotted)
+
+    if not viewport:
+        fig = models_figure(dff, x, y, colors_value, symbols_value,
+                            hover_data_value)
+    else:
+        fig = scatter_figure(dff, x, y, colors_value, symbols_value,
+                             hover_data_value)
+    if tracks:
+        add_tracks(fig, rows, x, y, x_function, y_function)
+    if viewport:
+        annotate_shown(fig, len(shown), len(rows))
+    return fig
+
+
+def annotate_shown(fig, shown, total):
+    if shown < total:
+        fig.add_annotation(
+            text=f'Showing {shown} of {total} models in view',
+            xref='paper', yref='paper', x=0, y=1.02,
+            xanchor='left', yanchor='bottom', showarrow=False)
+
+
+def axis_values(values, function=1):
+    """Apply the axis transform of the custom plot to column values."""
+    if function in axis_functions:
+        return functions[axis_functions[function]](values)
+    return values
+
+
+def viewport_box(viewport, x, y, x_function=1, y_function=1):
+    """Return the viewport as ranges of the untransformed columns."""
+    box = {}
+    for axis, name, function in (('xaxis', x, x_function),
+                                 ('yaxis', y, y_function)):
+        axis_range = (viewport or {}).get(axis)
+        if not axis_range:
+            continue
+        if function == 2:
+            axis_range = 10.0 ** np.asarray(axis_range)
+        elif function == 3:
+            axis_range = np.log10(np.clip(axis_range, 1e-300, None))
+        low, high = box.get(name, (-np.inf, np.inf))
+        box[name] = (max(low, axis_range[0]), min(high, axis_range[1]))
+    return box
+
+
+def query_models(ranges, x, y, colors_value, symbols_value,
+                 hover_data_value, viewport=None, x_function=1, y_function=1):
+    """Plot the selected models of the out-of-core mode.
+
+    Like `plot_models`, with the selection and the viewport filtered by
+    SQLite. A full view above `max_points` only fetches the columns of
+    its density map.
+    """
+    box = viewport_box(viewport, x, y, x_function, y_function)
+    with phase('filter'):
+        report('Selecting the models')
+        total = sql_grid.count(ranges, box)
+        note(rows=total)
+        names = [x, y, colors_value]
+        if viewport or total <= max_points:
+            names += [symbols_value] + (
+                ['id'] if lazy_hover else list(hover_data_value or []))
+        dff = sql_grid.frame(names, ranges, box,
+                             limit=max_points if viewport else None)
+
+    with phase('figure'):
+        report(f'Drawing {len(dff)} models')
+        plotted = {name: axis_values(dff[name].to_numpy(dtype=float),
+                                     function)
+                   for name, function in ((x, x_function), (y, y_function))
+                   if function != 1}
+        if plotted:
+            dff = dff.assign(**plotted)
+        if not viewport:
+            fig = models_figure(dff, x, y, colors_value, symbols_value,
+                                hover_data_value)
+        else:
+            fig = scatter_figure(dff, x, y, colors_value, symbols_value,
+                                 hover_data_value)
+            annotate_shown(fig, len(dff), total)
+    return fig
+
+
+def plot_selection(sliders, x, y, colors_value, symbols_value,
+                   hover_data_value, viewport=None, x_function=1,
+                   y_function=1, tracks=False):
+    """Plot the models selected by the slider values, from either backend.
+
+    Tracks are not drawn in the out-of-core mode.
+    """
+    if out_of_core:
+        ranges = dict(zip(grid_parameters, selection_key(*sliders)))
+        return query_models(ranges, x, y, colors_value, symbols_value,
+                            hover_data_value, viewport, x_function,
+                            y_function)
+    return plot_models(select_rows(*sliders), x, y, colors_value,
+                       symbols_value, hover_data_value, viewport,
+                       x_function, y_function, tracks)
+
+
+def track_lines(rows):
+    """Return the drawn models of the tracks through `rows`, in track order.
+
+    The positions where the tracks break are returned too.
+    """
+    grid = current()
+    return grid.track_index.lines(decimate(rows, max_points, grid.priority))
+
+
+@phase('shapes')
+def add_tracks(fig, rows, x, y, x_function=1, y_function=1):
+    """Draw the tracks through `rows` below the other traces."""
+    report('Drawing the tracks')
+    ordered, breaks = track_lines(rows)
+    fig.add_trace(track_trace(plot_values(x, x_function)[ordered],
+                              plot_values(y, y_function)[ordered], breaks))
+    fig.data = fig.data[-1:] + fig.data[:-1]
+
+
+@phase('shapes')
+def add_matches(fig, matches, x, y, color, x_function=1, y_function=1):
+    """Highlight the matched models over the plotted ones."""
+    if matches is None:
+        return
+    inside, best = shown_matches(matches)
+    for keys, role, name, marker in (
+            (inside, 'inside', 'within error ellipsoid',
+             {'symbol': 'circle-open', 'color': color}),
+            (best, 'best', 'best matches',
+             {'symbol': 'star', 'size': 12, 'color': color,
+              'line': {'color': 'white', 'width': 1}})):
+        xs, ys, ids = match_points(keys, x, y, x_function, y_function)
+        fig.add_trace({
+            'type': 'scattergl',
+            'x': xs,
+            'y': ys,
+            'customdata': ids,
+            'mode': 'markers',
+            'marker': marker,
+            'name': name,
+            'hovertemplate': '<br>'.join([
+                hover_label(x, 'x', xs), hover_label(y, 'y', ys),
+                'id=%{customdata}']),
+            'meta': role,
+        })
+
+
+def shown_matches(matches):
+    """Return the keys of the highlighted matches, inside and best."""
+    inside = matches['inside'][0]
+    if out_of_core:
+        # The models are sorted by chi-square, so the best ones are kept.
+        inside = inside[:max_points]
+    else:
+        inside = decimate(inside, max_points, current().priority)
+    return inside, matches['best'][0]
+
+
+def match_points(keys, x, y, x_function=1, y_function=1):
+    """Return the plotted values and ids of matched models.
+
+    `keys` are row positions, or model ids in the out-of-core mode.
+    """
+    if out_of_core:
+        frame = sql_grid.models(keys, [x, y])
+        return (axis_values(frame[x].to_numpy(dtype=float), x_function),
+                axis_values(frame[y].to_numpy(dtype=float), y_function),
+                frame['id'].to_numpy())
+    return (plot_values(x, x_function)[keys],
+            plot_values(y, y_function)[keys],
+            current().df['id'].to_numpy()[keys])
+
+
+@phase('shapes')
+def add_error_boxes(fig, x, x_err, y, y_err, sigma_range, color):
+    """Draw the target's error boxes up to `sigma_range` sigma."""
+    if not (x and x_err and y and y_err):
+        return
+    for sigma in range(1, sigma_range + 1):
+        fig.add_shape(type='rect',
+                      x0=x - sigma * x_err,
+                      y0=y - sigma * y_err,
+                      x1=x + sigma * x_err,
+                      y1=y + sigma * y_err,
+                      line={'color': color, 'width': 2})
+
+
+def set_axes(fig, viewport, x_reverse=False, y_reverse=False):
+    for axis, reverse in (('xaxis', x_reverse), ('yaxis', y_reverse)):
+        axis_range = (viewport or {}).get(axis)
+        if axis_range:
+            fig.update_layout({axis: {
+                'range': axis_range[::-1] if reverse else axis_range,
+                'autorange': False,
+            }})
+        else:
+            fig.update_layout(
+                {axis: {'autorange': 'reversed' if reverse else True}})
+
+
+def _relayout_range(relayout_data, axis):
+    if f'{axis}.range[0]' in relayout_data:
+        return sorted([relayout_data[f'{axis}.range[0]'],
+                       relayout_data[f'{axis}.range[1]']])
+    if f'{axis}.range' in relayout_data:
+        return sorted(relayout_data[f'{axis}.range'])
+    return None
+
+
+def viewport_from_relayout(relayout_data, viewport):
+    viewport = {axis: viewport[axis] for axis in ('xaxis', 'yaxis')
+                if viewport and viewport.get(axis)}
+    for axis in ('xaxis', 'yaxis'):
+        if relayout_data.get(f'{axis}.autorange'):
+            viewport.pop(axis, None)
+        axis_range = _relayout_range(relayout_data, axis)
+        if axis_range is not None:
+            viewport[axis] = axis_range
+    return viewport or None
+
+
+def update_viewport(relayout_data, viewport):
+    new_viewport = viewport_from_relayout(relayout_data or {}, viewport)
+    if new_viewport == viewport:
+        raise PreventUpdate
+    return new_viewport
+
+
+for graph_id in ['logg-teff', 'L-teff', 'R-teff']:
+    plot_callback(
+        Output(f'{graph_id}-viewport', 'data'),
+        Input(graph_id, 'relayoutData'),
+        State(f'{graph_id}-viewport', 'data'),
+    )(update_viewport)
+
+
 @app.callback(
-    Output('logg-teff', 'figure'),
+    Output('custom_plot-viewport', 'data'),
+    Input('custom_plot', 'relayoutData'),
+    State('custom_plot-viewport', 'data'),
+    State('x_custom_slider', 'value'),
+    State('x_custom_radio', 'value'),
+    State('y_custom_slider', 'value'),
+    State('y_custom_radio', 'value'),
+)
+def update_custom_viewport(relayout_data, viewport, x_name, x_function,
+                           y_name, y_function):
+    axes = [x_name, x_function, y_name, y_function]
+    if viewport and viewport.get('axes') != axes:
+        viewport = None
+    new_viewport = viewport_from_relayout(relayout_data or {}, viewport)
+    if new_viewport is not None:
+        new_viewport['axes'] = axes
+    if new_viewport == viewport:
+        raise PreventUpdate
+    return new_viewport
+
+
+@app.callback(
+    Output('target', 'data'),
     Input('submit_button', 'n_clicks'),
+    State('target_teff', 'value'),
+    State('target_teff_err', 'value'),
+    State('target_logg', 'value'),
+    State('target_logg_err', 'value'),
+    State('target_lum', 'value'),
+    State('target_lum_err', 'value'),
+    State('target_rad', 'value'),
+    State('target_rad_err', 'value'),
+    State('select_sigma', 'value'),
+    State('colorpicker', 'value'),
+)
+def update_target(n_clicks,
+                  target_teff,
+                  target_teff_err,
+                  target_logg,
+                  target_logg_err,
+                  target_lum,
+                  target_lum_err,
+                  target_rad,
+                  target_rad_err,
+                  sigma_range,
+                  box_color):
+    observed = zip(match_columns,
+                   [target_teff, target_logg, target_lum, target_rad],
+                   [target_teff_err, target_logg_err, target_lum_err,
+                    target_rad_err])
+    return {
+        'n_clicks': n_clicks,
+        # Like `parse_target`, columns without a positive error are left
+        # out.
+        'columns': {name: [value, error] for name, value, error in observed
+                    if value and error is not None and error > 0},
+        'sigma': sigma_range,
+        'color': box_color,
+    }
+
+
+@app.callback(
+    Output('matches_table', 'data'),
+    Output('matches_summary', 'children'),
+    Input('target', 'data'),
+)
+def update_matches(target):
+    matches = match_target(target)
+    if matches is None:
+        return [], 'Enter a target value with its error to find matches.'
+    keys, chi2 = matches['best']
+    names = match_table_columns[:1] + match_table_columns[2:]
+    if out_of_core:
+        table = sql_grid.models(keys, names)[names]
+    else:
+        table = current().df.iloc[keys][names]
+    single = [name for name in names if table[name].dtype == np.float32]
+    table = table.astype({name: float for name in match_table_columns[2:]})
+    table.insert(1, 'chi2', chi2)
+    table = table.round({name: 6 for name in table.columns
+                         if name not in single})
+    for name in single:
+        table[name] = float32_values(table[name])
+    summary = (f'{len(matches["inside"][0])} models within '
+               f'{target["sigma"]} sigma')
+    return table.to_dict('records'), summary
+
+
+def model_row(model_id):
+    """Return all columns of the model with `model_id`, or None."""
+    if out_of_core:
+        return sql_grid.row(model_id)
+    return current().row(model_id)
+
+
+@server.route('/models/<int:model_id>')
+def model_json(model_id):
+    row = model_row(model_id)
+    if row is None:
+        flask.abort(404, f'No model with id {model_id}')
+    return flask.jsonify(row)
+
+
+def hovered_id(event):
+    """Return the model id of a hovered or clicked point, if any."""
+    for point in (event or {}).get('points', []):
+        # The cells of a density map carry their number of models.
+        if 'z' not in point \
+                and isinstance(point.get('customdata'), (int, float)):
+            return int(point['customdata'])
+    return None
+
+
+if lazy_hover:
+    # The client-side plots do not carry the ids of their points.
+    detail_graphs = ['custom_plot'] if client_side else graph_ids
+
+    @app.callback(
+        Output('model_table', 'data'),
+        Output('model_summary', 'children'),
+        *[Input(graph_id, event) for graph_id in detail_graphs
+          for event in ('hoverData', 'clickData')],
+        prevent_initial_call=True,
+    )
+    def show_model(*events):
+        model_id = hovered_id(dash.callback_context.triggered[0]['value'])
+        row = None if model_id is None else model_row(model_id)
+        if row is None:
+            raise PreventUpdate
+        record = {name: round(value, 6) if isinstance(value, float)
+                  else value for name, value in row.items()}
+        return ([{name: record.get(name) for name in columns}],
+                f'Model {model_id}')
+
+
+@grid_callback(
+    Output('catalog_download', 'data'),
+    Output('catalog_status', 'children'),
+    Input('catalog_upload', 'contents'),
+    State('catalog_upload', 'filename'),
+    prevent_initial_call=True,
+    **background('catalog_progress'),
+)
+def fit_catalog_upload(contents, filename):
+    content = base64.b64decode(contents.split(',', 1)[1])
+    try:
+        targets = read_targets(io.BytesIO(content))
+    except ValueError as e:
+        return None, f'{filename}: {e}'
+    grid = current()
+    chunks = []
+    for start in range(0, len(targets), 100):
+        report(f'Fitted {start} of {len(targets)} targets')
+        chunks.append(fit_targets(grid.df, grid.matcher,
+                                  targets.iloc[start:start + 100]))
+    result = pd.concat(chunks, ignore_index=True) if chunks \
+        else pd.DataFrame(columns=result_columns)
+    fitted = result['target'].nunique()
+    return (dcc.send_data_frame(result.to_csv, 'fit_' + Path(filename).name,
+                                index=False),
+            f'Fitted {fitted} of {len(targets)} targets from {filename}')
+
+
+@plot_callback(
+    Output('logg-teff', 'figure'),
+    Input('target', 'data'),
     State('dropdown_colors', 'value'),
     State('dropdown_symbols', 'value'),
+    State('show_tracks', 'value'),
     State('z_i_slider', 'value'),
     State('m_i_slider', 'value'),
     State('m_env_slider', 'value'),
@@ -398,10 +1284,13 @@ app.layout = layout
     State('select_sigma', 'value'),
     State('colorpicker', 'value'),
     State('dropdown_hover_data', 'value'),
+    Input('logg-teff-viewport', 'data'),
+    **background('logg-teff-status'),
 )
-def update_logg_teff(n_clicks,
+def update_logg_teff(target,
                      colors_value,
                      symbols_value,
+                     tracks_value,
                      z_i_slider_value,
                      m_i_slider_value,
                      m_env_slider_value,
@@ -412,51 +1301,29 @@ def update_logg_teff(n_clicks,
                      target_logg_err,
                      sigma_range,
                      box_color,
-                     hover_data_value):
-    dff = df[(df['z_i'] >= min(z_i_slider_value))
-             & (df['z_i'] <= max(z_i_slider_value))]
-    dff = dff[(dff['m_i'] >= min(m_i_slider_value))
-              & (dff['m_i'] <= max(m_i_slider_value))]
-    dff = dff[(dff['m_env'] >= min(m_env_slider_value))
-              & (dff['m_env'] <= max(m_env_slider_value))]
-    dff = dff[(dff['y_c'] >= min(y_c_slider_value))
-              & (dff['y_c'] <= max(y_c_slider_value))]
-
-    fig = px.scatter(
-        data_frame=dff,
-        x='Teff',
-        y='log_g',
-        color=colors_value,
-        # color_continuous_scale='Inferno',
-        symbol=symbols_value,
-        hover_data=hover_data_value,
-        # labels={
-        #     'Teff': r'$T_\mathrm{eff}$',
-        #     'log_g': r'$\log\,g$'
-        # },
-    )
+                     hover_data_value,
+                     viewport):
+    sliders = [z_i_slider_value, m_i_slider_value, m_env_slider_value,
+               y_c_slider_value]
+    fig = plot_selection(sliders, 'Teff', 'log_g', colors_value,
+                         symbols_value, hover_data_value, viewport,
+                         tracks=tracks_value)
     fig.update_layout(legend_orientation='h')
-    fig.update_layout(height=800)
-    fig.update_xaxes(autorange='reversed')
-    fig.update_yaxes(autorange='reversed')
-
-    if target_teff and target_teff_err and target_logg and target_logg_err:
-        for sigma in range(1, sigma_range + 1):
-            fig.add_shape(type='rect',
-                          x0=target_teff - sigma * target_teff_err,
-                          y0=target_logg - sigma * target_logg_err,
-                          x1=target_teff + sigma * target_teff_err,
-                          y1=target_logg + sigma * target_logg_err,
-                          line={'color': box_color, 'width': 2})
+    fig.update_layout(height=800, uirevision='logg-teff')
+    set_axes(fig, viewport, x_reverse=True, y_reverse=True)
+    add_matches(fig, match_target(target), 'Teff', 'log_g', box_color)
+    add_error_boxes(fig, target_teff, target_teff_err, target_logg,
+                    target_logg_err, sigma_range, box_color)
 
-    return fig
+    return figure_response(fig)
 
 
-@app.callback(
+@plot_callback(
     Output('L-teff', 'figure'),
-    Input('submit_button', 'n_clicks'),
+    Input('target', 'data'),
     State('dropdown_colors', 'value'),
     State('dropdown_symbols', 'value'),
+    State('show_tracks', 'value'),
     State('z_i_slider', 'value'),
     State('m_i_slider', 'value'),
     State('m_env_slider', 'value'),
@@ -468,10 +1335,13 @@ def update_logg_teff(n_clicks,
     State('select_sigma', 'value'),
     State('colorpicker', 'value'),
     State('dropdown_hover_data', 'value'),
+    Input('L-teff-viewport', 'data'),
+    **background('L-teff-status'),
 )
-def update_lum_teff(n_clicks,
+def update_lum_teff(target,
                     colors_value,
                     symbols_value,
+                    tracks_value,
                     z_i_slider_value,
                     m_i_slider_value,
                     m_env_slider_value,
@@ -482,46 +1352,29 @@ def update_lum_teff(n_clicks,
                     target_lum_err,
                     sigma_range,
                     box_color,
-                    hover_data_value):
-    dff = df[(df['z_i'] >= min(z_i_slider_value))
-             & (df['z_i'] <= max(z_i_slider_value))]
-    dff = dff[(dff['m_i'] >= min(m_i_slider_value))
-              & (dff['m_i'] <= max(m_i_slider_value))]
-    dff = dff[(dff['m_env'] >= min(m_env_slider_value))
-              & (dff['m_env'] <= max(m_env_slider_value))]
-    dff = dff[(dff['y_c'] >= min(y_c_slider_value))
-              & (dff['y_c'] <= max(y_c_slider_value))]
-
-    fig = px.scatter(
-        data_frame=dff,
-        x='Teff',
-        y='L',
-        color=colors_value,
-        # color_continuous_scale='Inferno',
-        symbol=symbols_value,
-        hover_data=hover_data_value,
-    )
+                    hover_data_value,
+                    viewport):
+    sliders = [z_i_slider_value, m_i_slider_value, m_env_slider_value,
+               y_c_slider_value]
+    fig = plot_selection(sliders, 'Teff', 'L', colors_value,
+                         symbols_value, hover_data_value, viewport,
+                         tracks=tracks_value)
     fig.update_layout(legend_orientation='h')
-    fig.update_layout(height=800)
-    fig.update_xaxes(autorange='reversed')
-
-    if target_teff and target_teff_err and target_lum and target_lum_err:
-        for sigma in range(1, sigma_range + 1):
-            fig.add_shape(type='rect',
-                          x0=target_teff - sigma * target_teff_err,
-                          y0=target_lum - sigma * target_lum_err,
-                          x1=target_teff + sigma * target_teff_err,
-                          y1=target_lum + sigma * target_lum_err,
-                          line={'color': box_color, 'width': 2})
+    fig.update_layout(height=800, uirevision='L-teff')
+    set_axes(fig, viewport, x_reverse=True)
+    add_matches(fig, match_target(target), 'Teff', 'L', box_color)
+    add_error_boxes(fig, target_teff, target_teff_err, target_lum,
+                    target_lum_err, sigma_range, box_color)
 
-    return fig
+    return figure_response(fig)
 
 
-@app.callback(
+@plot_callback(
     Output('R-teff', 'figure'),
-    Input('submit_button', 'n_clicks'),
+    Input('target', 'data'),
     State('dropdown_colors', 'value'),
     State('dropdown_symbols', 'value'),
+    State('show_tracks', 'value'),
     State('z_i_slider', 'value'),
     State('m_i_slider', 'value'),
     State('m_env_slider', 'value'),
@@ -533,10 +1386,13 @@ def update_lum_teff(n_clicks,
     State('select_sigma', 'value'),
     State('colorpicker', 'value'),
     State('dropdown_hover_data', 'value'),
+    Input('R-teff-viewport', 'data'),
+    **background('R-teff-status'),
 )
-def update_radius_teff(n_clicks,
+def update_radius_teff(target,
                        colors_value,
                        symbols_value,
+                       tracks_value,
                        z_i_slider_value,
                        m_i_slider_value,
                        m_env_slider_value,
@@ -547,108 +1403,404 @@ def update_radius_teff(n_clicks,
                        target_rad_err,
                        sigma_range,
                        box_color,
-                       hover_data_value):
-    dff = df[(df['z_i'] >= min(z_i_slider_value))
-             & (df['z_i'] <= max(z_i_slider_value))]
-    dff = dff[(dff['m_i'] >= min(m_i_slider_value))
-              & (dff['m_i'] <= max(m_i_slider_value))]
-    dff = dff[(dff['m_env'] >= min(m_env_slider_value))
-              & (dff['m_env'] <= max(m_env_slider_value))]
-    dff = dff[(dff['y_c'] >= min(y_c_slider_value))
-              & (dff['y_c'] <= max(y_c_slider_value))]
-
-    fig = px.scatter(
-        data_frame=dff,
-        x='Teff',
-        y='radius',
-        color=colors_value,
-        # color_continuous_scale='Inferno',
-        symbol=symbols_value,
-        hover_data=hover_data_value,
-    )
+                       hover_data_value,
+                       viewport):
+    sliders = [z_i_slider_value, m_i_slider_value, m_env_slider_value,
+               y_c_slider_value]
+    fig = plot_selection(sliders, 'Teff', 'radius', colors_value,
+                         symbols_value, hover_data_value, viewport,
+                         tracks=tracks_value)
     fig.update_layout(legend_orientation='h')
-    fig.update_layout(height=800)
-    fig.update_xaxes(autorange='reversed')
-
-    if target_teff and target_teff_err and target_rad and target_rad_err:
-        for sigma in range(1, sigma_range + 1):
-            fig.add_shape(type='rect',
-                          x0=target_teff - sigma * target_teff_err,
-                          y0=target_rad - sigma * target_rad_err,
-                          x1=target_teff + sigma * target_teff_err,
-                          y1=target_rad + sigma * target_rad_err,
-                          line={'color': box_color, 'width': 2})
+    fig.update_layout(height=800, uirevision='R-teff')
+    set_axes(fig, viewport, x_reverse=True)
+    add_matches(fig, match_target(target), 'Teff', 'radius', box_color)
+    add_error_boxes(fig, target_teff, target_teff_err, target_rad,
+                    target_rad_err, sigma_range, box_color)
+
+    return figure_response(fig)
+
+
+axis_inputs = {'x_custom_slider.value', 'x_custom_radio.value',
+               'y_custom_slider.value', 'y_custom_radio.value'}
 
-    return fig
+
+@phase('figure')
+def axis_update(shown, axes):
+    """Return the values of the changed axes for the traces of a figure.
+
+    `shown` records the selection drawn by a full-view figure. The values
+    are given for each trace role (the `meta` of the trace), so the rest
+    of the figure is kept as it is.
+    """
+    grid = current()
+    rows = select_rows(*shown['sliders'])
+    matches = match_target(shown['target'])
+    update = {'uirevision': str(axes)}
+    for axis, (name, function), old in (('x', axes[:2], shown['axes'][:2]),
+                                        ('y', axes[2:], shown['axes'][2:])):
+        if [name, function] == old:
+            continue
+        values = plot_values(name, function)
+        arrays = {'points': values[rows]}
+        if shown['tracks']:
+            ordered, breaks = track_lines(rows)
+            arrays['tracks'] = track_values(values[ordered], breaks)
+        if matches is not None:
+            inside, best = shown_matches(matches)
+            arrays.update(inside=values[inside], best=values[best])
+        plotted = (grid.df[name] if function == 1 and name in grid.df.columns
+                   else values)
+        update[axis] = {'title': name, 'values': arrays,
+                        'label': hover_label(name, axis, plotted)}
+    return encoded_arrays(update) if typed_arrays else update
 
 
 @app.callback(
-    Output('custom_plot', 'figure'),
-    Input('submit_button', 'n_clicks'),
+    Output('custom_plot-figure', 'data'),
+    Output('custom_plot-shown', 'data'),
+    Input('target', 'data'),
     State('dropdown_colors', 'value'),
     State('dropdown_symbols', 'value'),
+    State('show_tracks', 'value'),
     State('z_i_slider', 'value'),
     State('m_i_slider', 'value'),
     State('m_env_slider', 'value'),
     State('y_c_slider', 'value'),
     State('dropdown_hover_data', 'value'),
     Input('x_custom_slider', 'value'),
-    Input('x_custom_reverse', 'value'),
     Input('x_custom_radio', 'value'),
     Input('y_custom_slider', 'value'),
-    Input('y_custom_reverse', 'value'),
     Input('y_custom_radio', 'value'),
+    Input('custom_plot-viewport', 'data'),
+    State('custom_plot-shown', 'data'),
+    **background('custom_plot-status'),
 )
-def update_custom_plot(n_clicks,
+def update_custom_plot(target,
                        colors_value,
                        symbols_value,
+                       tracks_value,
                        z_i_slider_value,
                        m_i_slider_value,
                        m_env_slider_value,
                        y_c_slider_value,
                        hover_data_value,
                        x_name,
-                       x_reverse,
                        x_function,
                        y_name,
-                       y_reverse,
-                       y_function):
-    dff = df[(df['z_i'] >= min(z_i_slider_value))
-             & (df['z_i'] <= max(z_i_slider_value))]
-    dff = dff[(dff['m_i'] >= min(m_i_slider_value))
-              & (dff['m_i'] <= max(m_i_slider_value))]
-    dff = dff[(dff['m_env'] >= min(m_env_slider_value))
-              & (dff['m_env'] <= max(m_env_slider_value))]
-    dff = dff[(dff['y_c'] >= min(y_c_slider_value))
-              & (dff['y_c'] <= max(y_c_slider_value))]
-
-    if x_function == 2:
-        dff[x_name] = np.log10(dff[x_name])
-    elif x_function == 3:
-        dff[x_name] = 10.0 ** dff[x_name]
-
-    if y_function == 2:
-        dff[y_name] = np.log10(dff[y_name])
-    elif y_function == 3:
-        dff[y_name] = 10.0 ** dff[y_name]
-
-    fig = px.scatter(
-        data_frame=dff,
-        x=x_name,
-        y=y_name,
-        color=colors_value,
-        # color_continuous_scale='Inferno',
-        symbol=symbols_value,
-        hover_data=hover_data_value,
-    )
+                       y_function,
+                       viewport,
+                       shown):
+    """Send the custom plot, or only new axis values, to the browser.
+
+    A change of the axis columns alone keeps the selection of a full-view
+    figure and only sends the values of the changed axes. The axes are
+    reversed in the browser, see `assets/custom_plot.js`.
+    """
+    axes = [x_name, x_function, y_name, y_function]
+    triggered = {trigger['prop_id']
+                 for trigger in dash.callback_context.triggered}
+    if shown and triggered <= axis_inputs:
+        return ({'axes': axis_update(shown, axes)},
+                dict(shown, axes=axes))
+
+    if viewport and viewport.get('axes') != axes:
+        viewport = None
+    sliders = [z_i_slider_value, m_i_slider_value, m_env_slider_value,
+               y_c_slider_value]
+    fig = plot_selection(sliders, x_name, y_name, colors_value,
+                         symbols_value, hover_data_value, viewport,
+                         x_function, y_function, tracks_value)
     fig.update_layout(legend_orientation='h')
-    fig.update_layout(height=800)
-    fig.update_xaxes(
-        autorange='reversed' if x_reverse else True)
-    fig.update_yaxes(
-        autorange='reversed' if y_reverse else True)
+    fig.update_layout(height=800, uirevision=str(axes))
+    set_axes(fig, viewport)
+    if target:
+        add_matches(fig, match_target(target), x_name, y_name,
+                    target['color'], x_function, y_function)
 
-    return fig
+    # Only full views of individual models can be updated axis by axis.
+    if out_of_core or viewport or not any(trace.meta == 'points'
+                                          for trace in fig.data):
+        shown = None
+    else:
+        shown = {'sliders': sliders, 'tracks': bool(tracks_value),
+                 'target': target, 'axes': axes}
+    return {'figure': figure_response(fig)}, shown
+
+
+app.clientside_callback(
+    ClientsideFunction('custom', 'render'),
+    Output('custom_plot', 'figure'),
+    Input('custom_plot-figure', 'data'),
+    Input('x_custom_reverse', 'value'),
+    Input('y_custom_reverse', 'value'),
+    State('custom_plot', 'figure'),
+)
+
+
+@grid_callback(
+    Output('interpolation_plot', 'figure'),
+    Output('interpolation_table', 'data'),
+    *[Input(f'interpolation_{name}', 'value')
+      for name, _, _ in interpolation_inputs],
+    Input('interpolation_vary', 'value'),
+    Input('interpolation_x', 'value'),
+    Input('interpolation_y', 'value'),
+)
+def update_interpolation(z_i, m_i, m_env, y_c, vary, x_name, y_name):
+    point = {'z_i': z_i, 'm_i': m_i, 'm_env': m_env, 'y_c': y_c}
+    if any(value is None for value in point.values()):
+        raise PreventUpdate
+    grid_cube = current().cube
+    sweep, curve = grid_cube.curve(point, vary, columns=[x_name, y_name])
+    fixed = ', '.join(f'{name}={value:g}' for name, value in point.items()
+                      if name != vary)
+    fig = go.Figure(data=[{
+        'type': 'scatter',
+        'x': curve[x_name],
+        'y': curve[y_name],
+        'customdata': sweep,
+        'mode': 'lines',
+        'name': fixed,
+        'hovertemplate': (f'{x_name}=%{{x}}<br>{y_name}=%{{y}}'
+                          f'<br>{vary}=%{{customdata}}<extra></extra>'),
+    }])
+    fig.update_layout(height=800, xaxis_title=x_name, yaxis_title=y_name,
+                      title=f'Interpolated along {vary} for {fixed}')
+
+    values = grid_cube.interpolate(
+        [[point[name] for name in grid_cube.parameters]])
+    table = [{'column': name,
+              'value': f'{values[name][0]:.6g}'
+              if np.isfinite(values[name][0]) else 'outside the grid'}
+             for name in interpolated_columns]
+    return fig, table
+
+
+def summary_cube():
+    """Return the summary cube of the grid used by the current request."""
+    return sql_grid.summary if out_of_core else current().summary
+
+
+@app.callback(
+    Output('summary_plot', 'figure'),
+    Output('summary_table', 'data'),
+    Output('summary_count', 'children'),
+    Input('z_i_slider', 'drag_value'),
+    Input('m_i_slider', 'drag_value'),
+    Input('m_env_slider', 'drag_value'),
+    Input('y_c_slider', 'drag_value'),
+    Input('summary_column', 'value'),
+    State('z_i_slider', 'value'),
+    State('m_i_slider', 'value'),
+    State('m_env_slider', 'value'),
+    State('y_c_slider', 'value'),
+)
+def update_summary(z_i_drag_value,
+                   m_i_drag_value,
+                   m_env_drag_value,
+                   y_c_drag_value,
+                   column,
+                   z_i_slider_value,
+                   m_i_slider_value,
+                   m_env_slider_value,
+                   y_c_slider_value):
+    """Summarize the slider selection while the sliders are dragged.
+
+    The numbers are reduced from the cells of the summary cube, without
+    reading the models.
+    """
+    sliders = [drag_value or value for drag_value, value in zip(
+        [z_i_drag_value, m_i_drag_value, m_env_drag_value, y_c_drag_value],
+        [z_i_slider_value, m_i_slider_value, m_env_slider_value,
+         y_c_slider_value])]
+    ranges = dict(zip(grid_parameters, selection_key(*sliders)))
+    cube = summary_cube()
+    models, statistics = cube.statistics(ranges)
+    fig = summary_figure(cube.marginals(ranges), column,
+                         cube.histogram(ranges, column))
+    table = [{'column': name, 'count': int(row['count']),
+              **{statistic: f'{row[statistic]:.6g}'
+                 for statistic in ('mean', 'min', 'max')}}
+             for name, row in statistics.iterrows()]
+    return figure_response(fig), table, f'{models} models selected'
+
+
+@app.callback(
+    Output('export_link', 'href'),
+    Input('z_i_slider', 'value'),
+    Input('m_i_slider', 'value'),
+    Input('m_env_slider', 'value'),
+    Input('y_c_slider', 'value'),
+    Input('dropdown_hover_data', 'value'),
+    Input('export_format', 'value'),
+    Input('export_matches', 'value'),
+    Input('target', 'data'),
+)
+def update_export_link(z_i_slider_value,
+                       m_i_slider_value,
+                       m_env_slider_value,
+                       y_c_slider_value,
+                       hover_data_value,
+                       export_format,
+                       export_matches,
+                       target):
+    sliders = [z_i_slider_value, m_i_slider_value, m_env_slider_value,
+               y_c_slider_value]
+    query = {name: f'{min(values)},{max(values)}'
+             for name, values in zip(grid_parameters, sliders)}
+    query['columns'] = ','.join(hover_data_value or [])
+    query['format'] = export_format
+    if export_matches and target and target['columns']:
+        query.update({name: f'{value},{error}' for name, (value, error)
+                      in target['columns'].items()})
+        query['sigma'] = target['sigma']
+    return app.get_relative_path('/export') + '?' + urlencode(query)
+
+
+@server.route('/export')
+def export_selection():
+    """Stream the models selected by the query parameters.
+
+    The parameters are the `low,high` ranges of the grid parameters, the
+    exported `columns` and `format`, and optionally the `value,error`
+    pairs of a target with the `sigma` of the matched models.
+    """
+    args = flask.request.args
+    try:
+        ranges = [parse_range(args[name]) for name in grid_parameters]
+        target = {name: parse_range(args[name]) for name in match_columns
+                  if name in args}
+        sigma = float(args.get('sigma', 1))
+    except (KeyError, ValueError):
+        flask.abort(400, 'Expected low,high ranges of z_i, m_i, m_env, y_c')
+    # As in the target of the viewer, errors must be positive.
+    target = {name: (value, error) for name, (value, error) in target.items()
+              if error > 0}
+    export_format = args.get('format', 'csv')
+    if export_format not in export_formats:
+        flask.abort(400, f'Unknown format {export_format}')
+    if export_format == 'parquet' \
+            and importlib.util.find_spec('pyarrow') is None:
+        flask.abort(501, 'Parquet export requires pyarrow')
+    export_columns = list(dict.fromkeys(
+        ['id'] + [name for name in args.get('columns', '').split(',')
+                  if name in columns]))
+
+    matcher = sql_grid if out_of_core else current().matcher
+    inside = None
+    if target:
+        try:
+            inside, _ = matcher.within(target, sigma)
+        except ValueError as e:
+            flask.abort(400, str(e))
+    if out_of_core:
+        chunks = sql_grid.chunks(
+            export_columns, dict(zip(grid_parameters, ranges)), inside)
+    else:
+        rows = select_rows(*ranges)
+        if inside is not None:
+            rows = np.intersect1d(rows, inside)
+        chunks = frame_chunks(current().df, rows, export_columns)
+
+    mimetype, extension = export_formats[export_format]
+    return flask.Response(
+        export_chunks(chunks, export_format),
+        mimetype=mimetype,
+        headers={'Content-Disposition':
+                 f'attachment; filename=sdb_grid_selection.{extension}'})
+
+
+if client_side:
+    app.clientside_callback(
+        ClientsideFunction('grid', 'load'),
+        Output('client_grid_ready', 'data'),
+        Input('client_grid_poll', 'n_intervals'),
+        State('client_grid', 'data'),
+    )
+    app.clientside_callback(
+        ClientsideFunction('grid', 'loaded'),
+        Output('client_grid_poll', 'disabled'),
+        Input('client_grid_ready', 'data'),
+    )
+    for view in views:
+        app.clientside_callback(
+            ClientsideFunction('grid', 'figure'),
+            Output(view['graph'], 'figure'),
+            Input('client_grid_ready', 'data'),
+            Input('z_i_slider', 'value'),
+            Input('m_i_slider', 'value'),
+            Input('m_env_slider', 'value'),
+            Input('y_c_slider', 'value'),
+            Input('dropdown_colors', 'value'),
+            Input('dropdown_symbols', 'value'),
+            Input('target', 'data'),
+            State(f'{view["graph"]}-view', 'data'),
+        )
+
+    @server.route('/client-grid/<content_hash>.bin')
+    def client_grid_file(content_hash):
+        payload = client_payloads.get(content_hash)
+        if payload is None:
+            flask.abort(404)
+        response = flask.Response(payload,
+                                  mimetype='application/octet-stream')
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+        response.set_etag(content_hash)
+        return response.make_conditional(flask.request)
+
+
+@grid_callback(
+    Output('derived_columns', 'data'),
+    Output('derived_status', 'children'),
+    Input('derived_add', 'n_clicks'),
+    State('derived_expression', 'value'),
+    State('derived_columns', 'data'),
+    prevent_initial_call=True,
+)
+def add_derived_column(n_clicks, expression, derived):
+    if not expression:
+        raise PreventUpdate
+    derived_columns = current().derived_columns
+    try:
+        name = derived_columns.parse(expression)
+        derived_columns.values(name)
+    except ValueError as e:
+        return dash.no_update, str(e)
+    if name in derived or name in columns:
+        return dash.no_update, f'{name} is already available'
+    return derived + [name], f'Added {name}'
+
+
+@app.callback(
+    Output('x_custom_slider', 'options'),
+    Output('y_custom_slider', 'options'),
+    Output('dropdown_colors', 'options'),
+    Input('derived_columns', 'data'),
+)
+def update_column_options(derived):
+    derived = [] if out_of_core else [name for name in derived or []
+                                      if name not in columns]
+    options = [{'label': label, 'value': label}
+               for label in columns + derived]
+    # The client-side plots only know the columns shipped to the browser.
+    colors = color_options if client_side else color_options + [
+        {'label': name, 'value': name} for name in derived]
+    return options, options, colors
+
+
+# The default view is the same for every visitor: its figures are kept
+# compressed and computed once at start-up. Background jobs keep their
+# results themselves, and answer with a job to poll instead of a figure.
+cache_responses = cache_mb > 0 and not background_jobs
+response_cache = ResponseCache(
+    app, ['..custom_plot-figure.data...custom_plot-shown.data..'] + (
+        [] if client_side else [f'{view["graph"]}.figure' for view in views]),
+    grid_version)
+if cache_responses:
+    response_cache.install()
+    response_cache.warm(layout())
 
 
 if __name__ == '__main__':